@@ -0,0 +1,67 @@
+"""In-memory stand-in for the handful of S3 client calls the function makes"""
+import io
+import threading
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class FakeS3:
+    """Drop-in for aws_client('s3'): put/get/head/delete object and list_objects_v2 paging"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.calls = {}
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def lookup(self, Bucket, Key):
+        with self.lock:
+            stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise NoSuchKey(f"s3://{Bucket}/{Key}")
+        return stored
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self.count('put_object')
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        with self.lock:
+            self.objects[(Bucket, Key)] = {'Body': Body, 'Metadata': dict(Metadata or {})}
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.count('get_object')
+        stored = self.lookup(Bucket, Key)
+        return {'Body': io.BytesIO(stored['Body']), 'Metadata': stored['Metadata'],
+                'ContentLength': len(stored['Body'])}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.count('head_object')
+        stored = self.lookup(Bucket, Key)
+        return {'Metadata': stored['Metadata'], 'ContentLength': len(stored['Body'])}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.count('delete_object')
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def get_paginator(self, operation):
+        if operation != 'list_objects_v2':
+            raise NotImplementedError(operation)
+        return self
+
+    def paginate(self, Bucket, Prefix='', **kwargs):
+        self.count('list_objects_v2')
+        with self.lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        for start in range(0, max(len(keys), 1), 1000):
+            yield {'Contents': [{'Key': key, 'Size': len(self.objects[(Bucket, key)]['Body'])}
+                                for key in keys[start:start + 1000]]}
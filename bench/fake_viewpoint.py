@@ -0,0 +1,201 @@
+"""Local stand-in for the Viewpoint employee portal, for benchmarks.
+
+Serves the employee-number login page, the earnings page with
+Document/GetFile links, PDFs behind a redirect and HTML error pages.
+Any username logs in with the password "pw-<username>".
+"""
+import http.server
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><title>Viewpoint For Cloud - Login</title></head>
+<body>
+{error}
+<button id="employeeNum" type="button"
+        onclick="document.getElementById('employee-form').style.display='block'">Employee Number</button>
+<form id="employee-form" method="post" action="/account/login?ReturnUrl=%2F" style="display:none">
+  <input type="hidden" name="__RequestVerificationToken" value="{token}">
+  <input type="hidden" name="LoginType" value="EmployeeNumber">
+  <input id="employee-num" name="EmployeeNumber" type="text" oninput="validate()">
+  <input id="password" name="Password" type="password" oninput="validate()">
+  <button type="submit" disabled>Sign In</button>
+</form>
+<script>
+function validate() {{
+  document.querySelector("button[type='submit']").disabled =
+    !(document.getElementById('employee-num').value && document.getElementById('password').value);
+}}
+</script>
+</body></html>"""
+
+EARNINGS_ROW = ('<tr><td class="pay-date">{date}</td>'
+                '<td><a href="/Document/GetFile?documentId={doc}&amp;type=paystub">View</a></td></tr>')
+
+ERROR_PAGE = """<!DOCTYPE html>
+<html><head><title>Error</title></head>
+<body><h1>Sorry, something went wrong.</h1><p>Reference {ref}</p></body></html>"""
+
+LOGIN_ERROR = ('<div class="validation-summary-errors"><ul>'
+               '<li>Invalid employee number or password.</li></ul></div>')
+
+TOKEN = 'bench-token'
+
+
+def fake_pdf(document, size):
+    """A PDF-looking payload of roughly `size` bytes, unique per document"""
+    header = f"%PDF-1.4\n% bench document {document}\n".encode('ascii')
+    return header + b'0' * max(0, size - len(header) - 6) + b'\n%%EOF'
+
+
+class FakeViewpoint(http.server.ThreadingHTTPServer):
+    """Threaded fake portal; knobs are plain attributes so a runner can tune them"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency_ms=25, pages=3, per_page=2, pdf_bytes=64 * 1024, flaky_every=0):
+        super().__init__(address, FakeViewpointHandler)
+        self.latency = latency_ms / 1000.0
+        self.pages = pages
+        self.per_page = per_page
+        self.pdf_bytes = pdf_bytes
+        self.flaky_every = flaky_every  # every Nth document errors once before serving
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failed_once = set()
+
+    def handle_error(self, request, client_address):
+        # Clients drop error and oversized responses mid-body on purpose
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+class FakeViewpointHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, content_type='text/html; charset=utf-8', headers=()):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, location, headers=()):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+
+    def user(self):
+        for part in (self.headers.get('Cookie') or '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 'bench_sid' and value:
+                return value
+        return None
+
+    def begin(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        return urlparse(self.path)
+
+    def do_GET(self):
+        url = self.begin()
+        path = url.path.lower()
+        query = parse_qs(url.query)
+        user = self.user()
+
+        if path == '/account/login':
+            return self.send_body(200, LOGIN_PAGE.format(token=TOKEN, error=''))
+        if not user:
+            return self.redirect('/account/login?ReturnUrl=%2F')
+        if path == '/':
+            return self.send_body(200, '<html><body><a href="/employee/earnings">Earnings</a></body></html>')
+        if path == '/employee/earnings':
+            return self.earnings(user, int((query.get('page') or ['1'])[0]))
+        if path == '/document/getfile':
+            document = (query.get('documentId') or [''])[0]
+            if not document.startswith(user + '-'):
+                return self.send_body(404, ERROR_PAGE.format(ref='not-found'))
+            if self.should_fail(document):
+                return self.send_body(503, ERROR_PAGE.format(ref=document))
+            # Viewpoint hands documents off to a file endpoint
+            return self.redirect(f"/files/{document}.pdf")
+        if path.startswith('/files/') and path.endswith('.pdf'):
+            document = url.path[len('/files/'):-len('.pdf')]
+            if not document.startswith(user + '-'):
+                return self.send_body(404, ERROR_PAGE.format(ref='not-found'))
+            return self.send_body(200, fake_pdf(document, self.server.pdf_bytes), 'application/pdf',
+                                  [('Content-Disposition', f'inline; filename="{document}.pdf"')])
+        return self.send_body(404, ERROR_PAGE.format(ref='not-found'))
+
+    def do_POST(self):
+        url = self.begin()
+        length = int(self.headers.get('Content-Length') or 0)
+        fields = parse_qs(self.rfile.read(length).decode('utf-8'))
+        if url.path.lower() != '/account/login':
+            return self.send_body(404, ERROR_PAGE.format(ref='not-found'))
+
+        username = (fields.get('EmployeeNumber') or [''])[0]
+        password = (fields.get('Password') or [''])[0]
+        if (fields.get('__RequestVerificationToken') or [''])[0] != TOKEN:
+            return self.send_body(400, ERROR_PAGE.format(ref='bad-token'))
+        if not username or password != f"pw-{username}":
+            # Like Viewpoint, wrong credentials re-render the login page with a validation summary
+            return self.send_body(200, LOGIN_PAGE.format(token=TOKEN, error=LOGIN_ERROR))
+        return self.redirect('/', [('Set-Cookie', f"bench_sid={username}; Path=/; HttpOnly")])
+
+    def earnings(self, user, page):
+        server = self.server
+        if page < 1 or page > server.pages:
+            return self.send_body(500, ERROR_PAGE.format(ref=f"page-{page}"))
+        rows = []
+        for n in range(server.per_page):
+            number = (server.pages - page) * server.per_page + (server.per_page - n)
+            rows.append(EARNINGS_ROW.format(date=f"2026-{(number - 1) % 12 + 1:02d}-15", doc=f"{user}-{number}"))
+        pager = ''
+        if page < server.pages:
+            pager = f'<a rel="next" href="/employee/earnings?page={page + 1}">Next</a>'
+        body = (f"<html><body><h1>Earnings</h1><table>{''.join(rows)}</table>{pager}"
+                f"</body></html>")
+        return self.send_body(200, body)
+
+    def should_fail(self, document):
+        """Every `flaky_every`-th document returns one 503 before it succeeds"""
+        every = self.server.flaky_every
+        if not every or int(document.rsplit('-', 1)[1]) % every:
+            return False
+        with self.server.lock:
+            if document in self.server.failed_once:
+                return False
+            self.server.failed_once.add(document)
+            return True
+
+
+def start(port=0, **options):
+    """Start the fake portal on a background thread and return the server"""
+    server = FakeViewpoint(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    server = start(8765)
+    print(f"Fake Viewpoint listening on {server.base_url}")
+    threading.Event().wait()
@@ -0,0 +1,255 @@
+"""End-to-end benchmark of lambda_handler against local fakes.
+
+Each scenario runs in a fresh Python process (so every run is a cold
+start and peak RSS is per scenario) with the fake Viewpoint portal, the
+SMTP sink and the in-memory S3 stand-in. It reports per-phase latency
+percentiles, users per minute and peak memory, and compares them with a
+stored baseline.
+
+    python bench/run_bench.py                    # 1, 10 and 100 users
+    python bench/run_bench.py --users 10 --concurrency 4
+    python bench/run_bench.py --users 30 --concurrency 6 --tenants 3
+    python bench/run_bench.py --save-baseline    # record bench/baseline.json
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# (metric, higher is better) pairs compared against the baseline
+COMPARED = [
+    ('users_per_min', True),
+    ('phases.total.p50', False),
+    ('phases.total.p90', False),
+    ('invocation_ms', False),
+    ('peak_rss_mb', False),
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_phases(results):
+    """Per-phase p50/p90/p99/max over every user's timings"""
+    samples = {}
+    for result in results:
+        for phase, ms in (result.get('timings') or {}).items():
+            samples.setdefault(phase, []).append(ms)
+    return {
+        phase: {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': max(values),
+        }
+        for phase, values in sorted(samples.items())
+    }
+
+
+def synthetic_users(count, base_urls=()):
+    """Users spread round-robin over the extra tenants' base URLs (none: all on the default one)"""
+    users = [{
+        'username': f"bench{n:04d}",
+        'password': f"pw-bench{n:04d}",
+        'email_to': f"bench{n:04d}@example.com",
+        'email_from': 'paystubs@example.com',
+        'email_pass': 'bench-smtp-password',
+        's3_bucket': 'bench-archive',
+    } for n in range(count)]
+    tenants = [None] + list(base_urls)
+    for n, user in enumerate(users):
+        if tenants[n % len(tenants)]:
+            user['base_url'] = tenants[n % len(tenants)]
+    return users
+
+
+def run_scenario(args):
+    """Child process: run one invocation for `args.child` users and print its report as JSON"""
+    sys.path.insert(0, REPO_DIR)
+    import fake_s3
+    import fake_viewpoint
+    import smtp_sink
+
+    portals = [fake_viewpoint.start(latency_ms=args.latency_ms, pdf_bytes=args.pdf_kb * 1024,
+                                    flaky_every=args.flaky_every) for _ in range(max(1, args.tenants))]
+    portal = portals[0]
+    sink = smtp_sink.start()
+    workdir = tempfile.mkdtemp(prefix='paystub-bench-')
+    os.environ.update({
+        'VIEWPOINT_BASE_URL': portal.base_url,
+        'LOGIN_ENGINE': args.engine,
+        'SESSION_CACHE_DIR': os.path.join(workdir, 'sessions'),
+        'DELIVERED_INDEX_DIR': os.path.join(workdir, 'delivered'),
+        'WORKSPACE_DIR': workdir,
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(sink.server_address[1]),
+        'SMTP_SSL': '0',
+        'SMTP_STARTTLS': '0',
+        'INVOKE_BACKEND': 'local',
+        'USERS_JSON': json.dumps(synthetic_users(args.child, [p.base_url for p in portals[1:]])),
+    })
+    if args.concurrency:
+        os.environ['MAX_CONCURRENCY'] = str(args.concurrency)
+    for name in ('SESSION_CACHE_BUCKET', 'DELIVERED_INDEX_BUCKET'):
+        os.environ.pop(name, None)
+
+    report_to = sys.stdout
+    log = open(os.devnull, 'w') if not args.verbose else sys.stderr
+    with contextlib.redirect_stdout(log):
+        import_started = time.perf_counter()
+        import lambda_function
+        import_ms = (time.perf_counter() - import_started) * 1000
+        s3 = fake_s3.FakeS3()
+        lambda_function.aws_clients['s3'] = s3
+
+        started = time.perf_counter()
+        response = lambda_function.lambda_handler(args.event and json.loads(args.event) or {}, None)
+        wall = time.perf_counter() - started
+
+    body = json.loads(response['body'])
+    results = body.get('results', [])
+    rss_kb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+              + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    report = {
+        'users': args.child,
+        'succeeded': sum(1 for r in results if r.get('success')),
+        'statuses': sorted({r.get('status') for r in results}),
+        'import_ms': round(import_ms, 1),
+        'invocation_ms': round(wall * 1000, 1),
+        'users_per_min': round(args.child / wall * 60, 1) if wall else None,
+        'peak_rss_mb': round(rss_kb / 1024, 1),
+        'phases': summarize_phases(results),
+        'portal_requests': sum(p.requests for p in portals),
+        'emails': sink.messages,
+        'smtp_connections': sink.connections,
+        's3_calls': s3.calls,
+    }
+    report_to.write(json.dumps(report) + '\n')
+    report_to.flush()
+    os._exit(0)  # skip joining daemon server threads
+
+
+def run_child(count, args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', str(count),
+               '--engine', args.engine, '--latency-ms', str(args.latency_ms),
+               '--pdf-kb', str(args.pdf_kb), '--flaky-every', str(args.flaky_every),
+               '--tenants', str(args.tenants)]
+    if args.concurrency:
+        command += ['--concurrency', str(args.concurrency)]
+    if args.event:
+        command += ['--event', args.event]
+    if args.verbose:
+        command.append('--verbose')
+    completed = subprocess.run(command, stdout=subprocess.PIPE, timeout=args.timeout, check=True)
+    return json.loads(completed.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def lookup(report, path):
+    value = report
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def print_report(report):
+    print(f"\n== {report['users']} users: {report['succeeded']} succeeded {report['statuses']}")
+    print(f"   {report['users_per_min']} users/min, invocation {report['invocation_ms']} ms, "
+          f"import {report['import_ms']} ms, peak RSS {report['peak_rss_mb']} MB")
+    print(f"   {report['portal_requests']} portal requests, {report['emails']} emails over "
+          f"{report['smtp_connections']} SMTP connections, S3 {report['s3_calls']}")
+    print(f"   {'phase':<24}{'n':>5}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for phase, stats in report['phases'].items():
+        print(f"   {phase:<24}{stats['count']:>5}" + ''.join(
+            f"{stats[key]:>10.1f}" for key in ('p50', 'p90', 'p99', 'max')))
+
+
+def compare(reports, baseline, tolerance):
+    """Print deltas against the baseline and return the regressions beyond tolerance"""
+    regressions = []
+    print(f"\n== Compared with baseline (tolerance {tolerance:.0%})")
+    for key, report in reports.items():
+        previous = baseline.get('scenarios', {}).get(key)
+        if not previous:
+            print(f"   {key} users: no baseline")
+            continue
+        for metric, higher_is_better in COMPARED:
+            old, new = lookup(previous, metric), lookup(report, metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = '  REGRESSION' if worse > tolerance else ''
+            print(f"   {key:>4} users {metric:<20}{old:>10.1f} -> {new:>10.1f} ({change:+.1%}){flag}")
+            if flag:
+                regressions.append((key, metric, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--engine', default='http', help="LOGIN_ENGINE for the run (selenium needs Chrome)")
+    parser.add_argument('--concurrency', type=int, help="MAX_CONCURRENCY for the run")
+    parser.add_argument('--latency-ms', type=float, default=25, help="Fake portal latency per request")
+    parser.add_argument('--pdf-kb', type=int, default=64)
+    parser.add_argument('--flaky-every', type=int, default=0, help="Every Nth document 503s once")
+    parser.add_argument('--tenants', type=int, default=1, help="Fake Viewpoint instances the users are spread over")
+    parser.add_argument('--event', help="Handler event as JSON, e.g. '{\"mode\": \"backfill\"}'")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed regression before failing")
+    parser.add_argument('--timeout', type=float, default=900)
+    parser.add_argument('--verbose', action='store_true', help="Show function logs on stderr")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        return run_scenario(args)
+
+    reports = {}
+    for count in args.users:
+        reports[str(count)] = report = run_child(count, args)
+        print_report(report)
+
+    settings = {name: getattr(args, name) for name in
+                ('engine', 'concurrency', 'latency_ms', 'pdf_kb', 'flaky_every', 'event')}
+    if args.tenants > 1:
+        settings['tenants'] = args.tenants
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'settings': settings, 'scenarios': reports}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\n💾 Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nℹ️ No baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('settings') != settings:
+        print(f"\n⚠️ Baseline was recorded with different settings: {baseline.get('settings')}")
+    return 1 if compare(reports, baseline, args.tolerance) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Minimal plaintext SMTP sink that accepts any login and counts messages"""
+import socketserver
+import threading
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, SmtpSinkHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.bytes = 0
+
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('ascii'))
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 bench-sink ESMTP')
+        data = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if data is not None:
+                if line in (b'.\r\n', b'.\n'):
+                    with server.lock:
+                        server.messages += 1
+                        server.bytes += data
+                    data = None
+                    self.reply('250 OK queued')
+                else:
+                    data += len(line)
+                continue
+
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250-bench-sink')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif command.startswith('AUTH'):
+                self.reply('235 Authentication successful')
+            elif command.startswith('DATA'):
+                data = 0
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command.startswith('QUIT'):
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+def start(port=0):
+    """Start the sink on a background thread and return the server"""
+    server = SmtpSink(('127.0.0.1', port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
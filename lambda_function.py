@@ -1,123 +1,1419 @@
+import time
+MODULE_IMPORT_STARTED = time.perf_counter()
+
+import io
+import base64
 import os
+import re
+import sys
 import json
-import time
+import html
+import hashlib
+import importlib
+import subprocess
+import functools
+from contextlib import contextmanager
+from html.parser import HTMLParser
+import queue
+import smtplib
+import threading
 import traceback
-import yagmail
-import boto3
+import uuid
 import glob
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException, ElementClickInterceptedException
+import shutil
+from urllib.parse import urljoin, urlparse, parse_qsl, urlencode
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-VP_LOGIN_URL = "https://gibson-hff.viewpointforcloud.com/account/login?ReturnUrl=%2F"
-EARNINGS_URL = "https://gibson-hff.viewpointforcloud.com/employee/earnings"
+# selenium, yagmail and boto3 are imported on first use so that invocations
+# which never need them (bad config, browserless runs) do not pay for them
 
-def get_parameter(name, decrypt=True):
-    """Get parameter from AWS SSM Parameter Store"""
+# Users without a "tenant" or "base_url" log in here
+VP_ORIGIN = os.environ.get('VIEWPOINT_BASE_URL', "https://gibson-hff.viewpointforcloud.com").rstrip('/')
+VP_TENANT_DOMAIN = os.environ.get('VIEWPOINT_TENANT_DOMAIN', 'viewpointforcloud.com')
+TENANT_MAX_CONCURRENCY = int(os.environ.get('TENANT_MAX_CONCURRENCY', '0'))
+
+# auto = HTTP login with Selenium fallback, http = HTTP only, selenium = browser only
+LOGIN_ENGINE = os.environ.get('LOGIN_ENGINE', 'auto').lower()
+
+SESSION_CACHE_ENABLED = os.environ.get('SESSION_CACHE_ENABLED', '1') == '1'
+SESSION_CACHE_DIR = os.environ.get('SESSION_CACHE_DIR', '/tmp/session-cache')
+SESSION_CACHE_BUCKET = os.environ.get('SESSION_CACHE_BUCKET')
+SESSION_CACHE_KMS_KEY = os.environ.get('SESSION_CACHE_KMS_KEY')
+
+DELIVERED_INDEX_DIR = os.environ.get('DELIVERED_INDEX_DIR', '/tmp/delivered-index')
+DELIVERED_INDEX_BUCKET = os.environ.get('DELIVERED_INDEX_BUCKET')
+
+PDF_MAX_BYTES = int(os.environ.get('PDF_MAX_BYTES', str(20 * 1024 * 1024)))
+PDF_TIMEOUT = float(os.environ.get('PDF_TIMEOUT', '30'))
+PDF_RETRIES = int(os.environ.get('PDF_RETRIES', '2'))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+    'Accept': 'application/pdf,*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1'
+}
+
+LEAN_BROWSER = os.environ.get('LEAN_BROWSER', '1') == '1'
+DEBUG_ARTIFACTS = os.environ.get('DEBUG_ARTIFACTS') == '1'
+
+# Resources the login and earnings pages work without
+BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.ico', '*.bmp',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm', '*.mp3', '*.ogg', '*.wav',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*fonts.googleapis.com*', '*fonts.gstatic.com*', '*hotjar.com*',
+    '*nr-data.net*', '*newrelic.com*', '*pendo.io*', '*walkme.com*',
+    '*intercom.io*', '*segment.io*', '*facebook.net*',
+] + [p.strip() for p in os.environ.get('BLOCKED_URL_PATTERNS', '').split(',') if p.strip()]
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'PaystubLambda')
+
+# Per-thread state: the worker's browser slot and the timings of the user it is processing
+worker_state = threading.local()
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_DEBUG_SAMPLE = max(1, int(os.environ.get('LOG_DEBUG_SAMPLE', '10')))
+LOG_BUFFER_MAX = 200
+SENSITIVE_FIELD = re.compile(r'pass|secret|token|cookie|credential|authorization', re.IGNORECASE)
+
+
+def redact(value, secrets=()):
+    """Mask sensitive keys and known secret values anywhere in a log field"""
+    if isinstance(value, dict):
+        return {k: '***' if SENSITIVE_FIELD.search(str(k)) else redact(v, secrets) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v, secrets) for v in value]
+    if isinstance(value, str):
+        for secret in secrets:
+            value = value.replace(secret, '***')
+    return value
+
+
+class Logger:
+    """Buffered single-line JSON logs with levels, per-user context and sampled debug lines.
+    
+    Inside a scope (a user, a delivery, the invocation itself) records are
+    buffered per thread and written with one stdout write when the scope
+    ends, the buffer fills or an error is logged. Debug lines are kept
+    only with LOG_LEVEL=DEBUG or for users with "debug": true, and past
+    the first of a kind only every LOG_DEBUG_SAMPLE-th repeat is kept.
+    """
+
+    def __init__(self, level=LOG_LEVEL):
+        self.level = LOG_LEVELS.get(level, LOG_LEVELS['INFO'])
+        self.write_lock = threading.Lock()
+        self.run_context = {}
+
+    def state(self):
+        state = getattr(worker_state, 'log', None)
+        if state is None:
+            state = worker_state.log = {'buffer': [], 'scopes': [], 'context': {}, 'secrets': [], 'seen': {}}
+        return state
+
+    def begin(self, secrets=(), **context):
+        """Start buffering this thread's records under extra context fields"""
+        state = self.state()
+        self.flush()
+        state['scopes'].append((state['context'], state['secrets'], state['seen']))
+        state['context'] = dict(state['context'], **context)
+        state['secrets'] = list(state['secrets'])
+        state['seen'] = {}
+        self.add_secrets(*secrets)
+
+    def end(self):
+        """Write the scope's buffered records and restore the enclosing context"""
+        state = self.state()
+        self.flush()
+        if state['scopes']:
+            state['context'], state['secrets'], state['seen'] = state['scopes'].pop()
+
+    def context(self):
+        """The current thread's context, to carry a user's fields onto another thread"""
+        return dict(self.state()['context'])
+
+    def add_secrets(self, *secrets):
+        """Values (such as resolved passwords) to mask in every record of the scope"""
+        self.state()['secrets'].extend(s for s in secrets if isinstance(s, str) and len(s) >= 4)
+
+    def enabled(self, level):
+        return LOG_LEVELS[level] >= self.level or debug_enabled()
+
+    def log(self, level, message, **fields):
+        if not self.enabled(level):
+            return
+        state = self.state()
+        if level == 'DEBUG':
+            # Sample repeats of the same line shape (numbers ignored)
+            kind = re.sub(r'\d+', '#', message)[:80]
+            seen = state['seen'][kind] = state['seen'].get(kind, 0) + 1
+            if seen > 1 and not debug_enabled():
+                if (seen - 1) % LOG_DEBUG_SAMPLE:
+                    return
+                fields['sampled'] = LOG_DEBUG_SAMPLE
+        record = {'ts': round(time.time(), 3), 'level': level, 'msg': message.strip()}
+        record.update(self.run_context)
+        record.update(state['context'])
+        record.update(fields)
+        line = json.dumps(redact(record, state['secrets']), separators=(',', ':'), ensure_ascii=False, default=str)
+        self.emit(line, flush=level == 'ERROR')
+
+    def emit(self, line, flush=False):
+        state = self.state()
+        if not state['scopes']:
+            self.write([line])
+            return
+        state['buffer'].append(line)
+        if flush or len(state['buffer']) >= LOG_BUFFER_MAX:
+            self.flush()
+
+    def raw(self, record):
+        """Buffer an already structured record as is (e.g. an EMF metrics line)"""
+        self.emit(json.dumps(record, separators=(',', ':')))
+
+    def flush(self):
+        state = self.state()
+        if state['buffer']:
+            lines, state['buffer'] = state['buffer'], []
+            self.write(lines)
+
+    def write(self, lines):
+        with self.write_lock:
+            sys.stdout.write('\n'.join(lines) + '\n')
+            sys.stdout.flush()
+
+    def debug(self, message, **fields):
+        self.log('DEBUG', message, **fields)
+
+    def info(self, message, **fields):
+        self.log('INFO', message, **fields)
+
+    def warning(self, message, **fields):
+        self.log('WARNING', message, **fields)
+
+    def error(self, message, **fields):
+        self.log('ERROR', message, **fields)
+
+    def exception(self, message, **fields):
+        """Log an error with the current exception and its innermost frames (all of them when debugging)"""
+        error_type, error, tb = sys.exc_info()
+        frames = traceback.extract_tb(tb)
+        if not self.enabled('DEBUG'):
+            frames = frames[-3:]
+        fields.setdefault('error', f"{getattr(error_type, '__name__', 'Error')}: {error}")
+        fields['trace'] = [f"{os.path.basename(f.filename)}:{f.lineno} {f.name}" for f in frames]
+        self.error(message, **fields)
+
+
+log = Logger()
+
+
+@contextmanager
+def span(name):
+    """Time a phase and add its duration to the current user's timings"""
+    tracker = getattr(worker_state, 'resources', None)
+    if tracker is not None:
+        resource_monitor.enter(tracker, name)
+    started = time.perf_counter()
     try:
-        ssm = boto3.client('ssm', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
-        response = ssm.get_parameter(Name=name, WithDecryption=decrypt)
-        return response['Parameter']['Value']
-    except Exception as e:
-        print(f"Error getting parameter {name}: {e}")
+        yield
+    finally:
+        timings = getattr(worker_state, 'timings', None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + (time.perf_counter() - started) * 1000
+        if tracker is not None:
+            resource_monitor.exit(tracker, name)
+
+
+def timed(name):
+    """Decorator form of span() for functions that are a whole phase"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def emit_metrics(scope, timings, properties=None, megabytes=None):
+    """Print phase durations (and memory/disk peaks) as a CloudWatch Embedded Metric Format record"""
+    megabytes = megabytes or {}
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Scope']],
+                'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in timings]
+                           + [{'Name': name, 'Unit': 'Megabytes'} for name in megabytes],
+            }],
+        },
+        'Scope': scope,
+    }
+    record.update(properties or {})
+    record.update({name: round(ms, 1) for name, ms in timings.items()})
+    record.update({name: round(mb, 1) for name, mb in megabytes.items()})
+    log.raw(record)
+
+
+RESOURCE_SAMPLING = os.environ.get('RESOURCE_SAMPLING', '1') == '1' and os.path.isdir('/proc')
+RESOURCE_SAMPLE_INTERVAL = float(os.environ.get('RESOURCE_SAMPLE_INTERVAL', '0.25'))
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+MB = 1024 * 1024
+
+
+def read_process_stat(pid):
+    """Return (ppid, RSS bytes, CPU seconds) of a process, or None once it has exited"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
         return None
+    # The command name is parenthesised and may itself contain spaces
+    fields = stat[stat.rindex(')') + 2:].split()
+    return (int(fields[1]), int(fields[21]) * PAGE_SIZE,
+            (int(fields[11]) + int(fields[12])) / CLOCK_TICKS)
 
 
-def download_pdf_with_session(driver, pdf_url):
-    """Download PDF using requests with session cookies from Selenium"""
-    import requests
+def read_process_table():
+    """Map pid -> (ppid, RSS bytes, CPU seconds) for every process visible in /proc"""
+    table = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            stat = read_process_stat(entry)
+            if stat:
+                table[int(entry)] = stat
+    return table
+
+
+def tree_pids(children, root):
+    """A process and all of its descendants"""
+    pids, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, ()))
+    return pids
+
+
+def sum_usage(stats):
+    """Total RSS and CPU seconds of (ppid, rss, cpu) stats"""
+    return sum(s[1] for s in stats), sum(s[2] for s in stats)
+
+
+def tmp_used_bytes():
+    """Bytes in use on the filesystem holding /tmp (Lambda's ephemeral storage)"""
+    stats = os.statvfs('/tmp')
+    return (stats.f_blocks - stats.f_bfree) * stats.f_frsize
+
+
+class ResourceMonitor:
+    """Background sampler of handler, ChromeDriver/Chrome and /tmp usage.
     
-    print("📥 Downloading PDF with session...")
+    Samples are only taken while a user is being processed. Each sample
+    raises the peaks of every tracked user and of the phases (spans)
+    they are in. Phase boundaries get a cheap sample of just this
+    process and the user's browser, so short phases are not missed and
+    per-phase CPU can be measured. Browser figures cover the ChromeDriver
+    process tree of the user's own worker slot, so they stay per-user
+    under concurrency.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.trackers = []
+        self.active = threading.Event()
+        self.thread = None
+        self.peak = {}
+        self.browser_pids = {}  # slot -> pids of its browser tree at the last full sample
+
+    def start_user(self):
+        """Begin tracking the current worker's user and return its tracker"""
+        tracker = {
+            'slot': getattr(worker_state, 'slot', 0),
+            'stack': [],
+            'started': {},
+            'peak': {},
+            'phases': {},
+        }
+        with self.lock:
+            self.trackers.append(tracker)
+            self.active.set()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='resource-sampler', daemon=True)
+                self.thread.start()
+        self.sample()
+        return tracker
+
+    def stop_user(self, tracker):
+        """Stop tracking a user and return its peaks, overall and per phase"""
+        self.sample()
+        with self.lock:
+            self.trackers.remove(tracker)
+            if not self.trackers:
+                self.active.clear()
+        return {
+            'peak': {name: round(value, 1) for name, value in tracker['peak'].items()},
+            'phases': {phase: {name: round(value, 1) for name, value in values.items()}
+                       for phase, values in tracker['phases'].items()},
+        }
+
+    def reset_peak(self):
+        with self.lock:
+            self.peak = {}
+
+    def enter(self, tracker, phase):
+        usage = self.sample_user(tracker)
+        with self.lock:
+            tracker['stack'].append(phase)
+            tracker['started'][phase] = (time.thread_time(), usage['browser_cpu'])
+
+    def exit(self, tracker, phase):
+        usage = self.sample_user(tracker)
+        with self.lock:
+            if phase in tracker['stack']:
+                tracker['stack'].remove(phase)
+            thread_cpu, browser_cpu = tracker['started'].pop(phase, (None, None))
+            if thread_cpu is None:
+                return
+            values = tracker['phases'].setdefault(phase, {})
+            values['cpu_ms'] = values.get('cpu_ms', 0.0) + (time.thread_time() - thread_cpu) * 1000
+            values['browser_cpu_ms'] = (values.get('browser_cpu_ms', 0.0)
+                                        + max(0.0, usage['browser_cpu'] - browser_cpu) * 1000)
+
+    def sample_user(self, tracker):
+        """Cheap sample of this process and one user's browser, using the last known browser pids"""
+        try:
+            python = read_process_stat('self')
+            browser = sum_usage([stat for stat in map(read_process_stat, self.browser_pids.get(tracker['slot'], ()))
+                                 if stat])
+            usage = {
+                'python_rss_mb': python[1] / MB,
+                'browser_rss_mb': browser[0] / MB,
+                'tmp_used_mb': tmp_used_bytes() / MB,
+                'browser_cpu': browser[1],
+            }
+        except Exception as e:
+            log.warning(f"⚠️ Resource sample failed: {e}")
+            return {'browser_cpu': 0.0}
+        with self.lock:
+            values = {name: usage[name] for name in ('python_rss_mb', 'browser_rss_mb', 'tmp_used_mb')}
+            raise_peaks(tracker['peak'], values)
+            for phase in tracker['stack']:
+                raise_peaks(tracker['phases'].setdefault(phase, {}), values)
+        return usage
+
+    def sample(self):
+        """Scan every process once and fold the result into every tracked user's peaks"""
+        try:
+            table = read_process_table()
+            children = {}
+            for pid, (ppid, _, _) in table.items():
+                children.setdefault(ppid, []).append(pid)
+            browser_pids = {}
+            for slot, manager in list(driver_managers.items()):
+                pid = manager.service_pid()
+                if pid in table:
+                    browser_pids[slot] = tree_pids(children, pid)
+            own = os.getpid()
+            python_rss = table[own][1] if own in table else 0
+            total_rss = sum_usage([table[pid] for pid in tree_pids(children, own) if pid in table])[0]
+            tmp_used = tmp_used_bytes()
+        except Exception as e:
+            log.warning(f"⚠️ Resource sample failed: {e}")
+            return
+        with self.lock:
+            self.browser_pids = browser_pids
+            container = {
+                'python_rss_mb': python_rss / MB,
+                'children_rss_mb': (total_rss - python_rss) / MB,
+                'total_rss_mb': total_rss / MB,
+                'tmp_used_mb': tmp_used / MB,
+            }
+            raise_peaks(self.peak, container)
+            for tracker in self.trackers:
+                browser_rss = sum_usage([table[pid] for pid in browser_pids.get(tracker['slot'], ())])[0]
+                values = dict(container, browser_rss_mb=browser_rss / MB)
+                raise_peaks(tracker['peak'], values)
+                for phase in tracker['stack']:
+                    raise_peaks(tracker['phases'].setdefault(phase, {}), values)
+
+    def run(self):
+        while True:
+            self.active.wait()
+            self.sample()
+            time.sleep(self.interval)
+
+
+def raise_peaks(peaks, values):
+    for name, value in values.items():
+        if name not in peaks or value > peaks[name]:
+            peaks[name] = value
+
+
+resource_monitor = ResourceMonitor(RESOURCE_SAMPLE_INTERVAL)
+
+
+# Cold-start accounting, printed once by the first invocation in a container
+INIT_REPORT = {'lazy_imports': {}}
+cold_start = True
+
+
+lazy_import_lock = threading.Lock()
+
+
+def lazy_import(name):
+    """Import a heavy module on first use and record what it cost"""
+    if name in INIT_REPORT['lazy_imports']:
+        return sys.modules[name]
+    # Serialise first imports so worker threads never see a half-initialised module
+    with lazy_import_lock:
+        if name not in INIT_REPORT['lazy_imports']:
+            started = time.perf_counter()
+            importlib.import_module(name)
+            INIT_REPORT['lazy_imports'][name] = round((time.perf_counter() - started) * 1000, 1)
+        return sys.modules[name]
+
+
+# boto3 clients are thread-safe, so one per service serves the whole container
+aws_clients = {}
+aws_clients_lock = threading.Lock()
+
+# Synchronous shard invocations can run for the worker's whole timeout
+AWS_CLIENT_CONFIG = {
+    'lambda': {'read_timeout': 910, 'retries': {'max_attempts': 0}},
+}
+
+
+def aws_client(service):
+    """Return a cached boto3 client for a service"""
+    with aws_clients_lock:
+        if service not in aws_clients:
+            boto3 = lazy_import('boto3')
+            from botocore.config import Config
+            aws_clients[service] = boto3.client(
+                service,
+                region_name=os.environ.get('AWS_REGION', 'us-east-1'),
+                config=Config(**AWS_CLIENT_CONFIG.get(service, {}))
+            )
+        return aws_clients[service]
+
+
+ENV_PROBES = None
+
+
+def probe_environment():
+    """Read the Chrome and ChromeDriver versions once per container"""
+    global ENV_PROBES
+    if ENV_PROBES is None:
+        ENV_PROBES = {}
+        for name, binary in (('chrome', '/opt/chrome/chrome'), ('chromedriver', '/opt/chromedriver')):
+            try:
+                ENV_PROBES[name] = subprocess.run(
+                    [binary, '--version'], capture_output=True, text=True, timeout=10
+                ).stdout.strip()
+            except Exception as e:
+                ENV_PROBES[name] = None
+                log.error(f"❌ Could not get {name} version: {e}")
+    return ENV_PROBES
+
+
+SECRET_TTL_SECONDS = float(os.environ.get('SECRET_TTL_SECONDS', '900'))
+
+
+class SecretResolver:
+    """Resolve SSM parameters with batched GetParameters calls and a TTL cache"""
+
+    BATCH_SIZE = 10  # GetParameters limit
+
+    def __init__(self, client=None, ttl=SECRET_TTL_SECONDS):
+        self.client = client
+        self.ttl = ttl
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def is_fresh(self, name):
+        entry = self.cache.get(name)
+        return entry is not None and time.time() - entry[1] < self.ttl
+
+    def prefetch(self, names):
+        """Fetch every name not already cached, ten per request on one client"""
+        with self.lock:
+            missing = sorted({n for n in names if n and not self.is_fresh(n)})
+            if not missing:
+                return
+            ssm = self.client or aws_client('ssm')
+            for i in range(0, len(missing), self.BATCH_SIZE):
+                batch = missing[i:i + self.BATCH_SIZE]
+                try:
+                    response = ssm.get_parameters(Names=batch, WithDecryption=True)
+                except Exception as e:
+                    log.error(f"❌ Error getting parameters {batch}: {e}")
+                    continue
+                fetched_at = time.time()
+                for parameter in response.get('Parameters', []):
+                    self.cache[parameter['Name']] = (parameter['Value'], fetched_at)
+                for name in response.get('InvalidParameters', []):
+                    log.error(f"❌ Error getting parameter {name}: not found")
+            log.info(f"🔑 Resolved {len(missing)} parameters in {(len(missing) + self.BATCH_SIZE - 1) // self.BATCH_SIZE} requests")
+
+    def get(self, name):
+        """Return a parameter value, fetching it if it is not cached"""
+        if not self.is_fresh(name):
+            self.prefetch([name])
+        entry = self.cache.get(name)
+        return entry[0] if entry else None
+
+    def invalidate(self, *names):
+        """Drop cached values, e.g. after the credential they hold was rejected"""
+        with self.lock:
+            for name in names:
+                self.cache.pop(name, None)
+
+
+secret_resolver = SecretResolver()
+
+
+def get_parameter(name, decrypt=True):
+    """Get parameter from AWS SSM Parameter Store (cached, always decrypted)"""
+    return secret_resolver.get(name)
+
+
+def prefetch_user_secrets(users):
+    """Resolve every user's SSM parameters up front in as few requests as possible"""
+    secret_resolver.prefetch([
+        user_config[key] for user_config in users
+        for key in ('password_param', 'email_pass_param') if user_config.get(key)
+    ])
+
+
+Tenant = namedtuple('Tenant', ['host', 'origin', 'login_url', 'earnings_url'])
+
+
+def make_tenant(origin):
+    """The Viewpoint URLs of one instance"""
+    origin = origin.rstrip('/')
+    return Tenant(urlparse(origin).netloc.lower(), origin,
+                  f"{origin}/account/login?ReturnUrl=%2F", f"{origin}/employee/earnings")
+
+
+DEFAULT_TENANT = make_tenant(VP_ORIGIN)
+
+
+def tenant_for(user_config):
+    """A user's Viewpoint instance: its base_url, its tenant subdomain or VIEWPOINT_BASE_URL"""
+    if user_config.get('base_url'):
+        return make_tenant(user_config['base_url'])
+    if user_config.get('tenant'):
+        return make_tenant(f"https://{user_config['tenant']}.{VP_TENANT_DOMAIN}")
+    return DEFAULT_TENANT
+
+
+def current_tenant():
+    """The Viewpoint instance of the user this thread is working for"""
+    return getattr(worker_state, 'tenant', None) or DEFAULT_TENANT
+
+
+@contextmanager
+def tenant_context(tenant):
+    """Work for a tenant on this thread, e.g. on a pool thread helping a user"""
+    previous = getattr(worker_state, 'tenant', None)
+    worker_state.tenant = tenant
+    try:
+        yield tenant
+    finally:
+        worker_state.tenant = previous
+
+
+def user_key(username, host):
+    """A user's name in worker payloads and checkpoints; outside the default tenant it carries the host"""
+    if host == DEFAULT_TENANT.host:
+        return username
+    return f"{host}/{username}"
+
+
+def split_user_key(key):
+    """The username and host named by a user key"""
+    host, slash, username = key.partition('/')
+    if not slash:
+        return {'username': key, 'host': DEFAULT_TENANT.host}
+    return {'username': username, 'host': host}
+
+
+def tenant_groups(users):
+    """User indices grouped by Viewpoint host, in order of each host's first user"""
+    first_seen = {}
+    hosts = [tenant_for(u).host for u in users]
+    for host in hosts:
+        first_seen.setdefault(host, len(first_seen))
+    return sorted(range(len(users)), key=lambda i: first_seen[hosts[i]])
+
+
+# Connection pools shared by every requests session in this container: one
+# per Viewpoint host, so busy tenants never evict each other's warm
+# connections, and a shared one for everything else (e.g. file redirects)
+http_adapters = {}
+http_adapter_lock = threading.Lock()
+
+
+def get_http_adapter(host=None):
+    """Return the pooled HTTP adapter for a Viewpoint host (or the shared one), creating it on first use"""
+    from requests.adapters import HTTPAdapter
     
-    # Get all cookies from Selenium
-    selenium_cookies = driver.get_cookies()
+    with http_adapter_lock:
+        if host not in http_adapters:
+            http_adapters[host] = HTTPAdapter(pool_connections=1 if host else 4, pool_maxsize=HTTP_POOL_SIZE)
+        return http_adapters[host]
+
+
+def session_from_cookies(cookies):
+    """Build a requests session carrying the given Selenium-style cookies"""
+    import requests
     
-    # Create requests session and add cookies
+    # Sessions keep their own cookie jars but share pooled connections
+    tenant = current_tenant()
     session = requests.Session()
-    for cookie in selenium_cookies:
+    session.mount('https://', get_http_adapter())
+    session.mount('http://', get_http_adapter())
+    session.mount(tenant.origin + '/', get_http_adapter(tenant.host))
+    for cookie in cookies:
         session.cookies.set(
             cookie['name'], 
             cookie['value'],
             domain=cookie.get('domain'),
             path=cookie.get('path', '/')
         )
+    session.headers.update(BROWSER_HEADERS)
+    return session
+
+
+def session_cache_key(username):
+    """Cache key for a user's cookie jar, so usernames never appear in paths"""
+    tenant = current_tenant()
+    if tenant.origin != DEFAULT_TENANT.origin:
+        # Employee numbers are only unique within one Viewpoint instance
+        username = f"{tenant.host}/{username}"
+    return hashlib.sha256(username.encode('utf-8')).hexdigest()
+
+
+def load_cached_cookies(username):
+    """Load a cached authenticated cookie jar from /tmp, falling back to S3"""
+    key = session_cache_key(username)
+    path = os.path.join(SESSION_CACHE_DIR, f"{key}.json")
+    try:
+        with open(path) as f:
+            return json.load(f)['cookies']
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.warning(f"⚠️ Ignoring unreadable session cache: {e}")
     
-    # Copy headers from Selenium
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-        'Accept': 'application/pdf,*/*',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1'
-    })
+    if not SESSION_CACHE_BUCKET:
+        return None
+    try:
+        s3 = aws_client('s3')
+        response = s3.get_object(Bucket=SESSION_CACHE_BUCKET, Key=f"sessions/{key}.json")
+        cookies = json.loads(response['Body'].read())['cookies']
+        write_cookie_file(path, cookies)
+        return cookies
+    except Exception as e:
+        log.debug(f"ℹ️ No cached session in S3: {e}")
+        return None
+
+
+def write_cookie_file(path, cookies):
+    """Write a cookie jar readable only by the function's user"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'saved_at': int(time.time()), 'cookies': cookies}, f)
+
+
+def save_cached_cookies(username, cookies):
+    """Cache an authenticated cookie jar in /tmp and, if configured, encrypted in S3"""
+    if not SESSION_CACHE_ENABLED:
+        return
+    key = session_cache_key(username)
+    try:
+        write_cookie_file(os.path.join(SESSION_CACHE_DIR, f"{key}.json"), cookies)
+    except Exception as e:
+        log.warning(f"⚠️ Failed to cache session locally: {e}")
+    
+    if not SESSION_CACHE_BUCKET:
+        return
+    try:
+        s3 = aws_client('s3')
+        extra = {'ServerSideEncryption': 'aws:kms'}
+        if SESSION_CACHE_KMS_KEY:
+            extra['SSEKMSKeyId'] = SESSION_CACHE_KMS_KEY
+        s3.put_object(
+            Bucket=SESSION_CACHE_BUCKET,
+            Key=f"sessions/{key}.json",
+            Body=json.dumps({'saved_at': int(time.time()), 'cookies': cookies}),
+            ContentType='application/json',
+            **extra
+        )
+    except Exception as e:
+        log.warning(f"⚠️ Failed to cache session in S3: {e}")
+
+
+def drop_cached_cookies(username):
+    """Forget a cached session once the server no longer accepts it"""
+    key = session_cache_key(username)
+    try:
+        os.remove(os.path.join(SESSION_CACHE_DIR, f"{key}.json"))
+    except FileNotFoundError:
+        pass
+    if SESSION_CACHE_BUCKET:
+        try:
+            s3 = aws_client('s3')
+            s3.delete_object(Bucket=SESSION_CACHE_BUCKET, Key=f"sessions/{key}.json")
+        except Exception as e:
+            log.warning(f"⚠️ Failed to drop cached session from S3: {e}")
+
+
+# Query parameters that name the document itself, most specific first; any
+# other *Id parameter (companyId, employeeId, ...) can be shared by many
+DOCUMENT_ID_PARAMS = ('documentid', 'docid', 'fileid', 'id')
+
+
+def document_id(pdf_url):
+    """Stable ID of a Document/GetFile link: its document ID parameter, else a hash of the normalised link"""
+    parsed = urlparse(pdf_url)
+    params = parse_qsl(parsed.query)
+    values = {name.lower(): value for name, value in params if value}
+    for name in DOCUMENT_ID_PARAMS:
+        if name in values:
+            return values[name]
+    normalised = parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower(),
+                                 query=urlencode(sorted(params)), fragment='').geturl()
+    return hashlib.sha256(normalised.encode('utf-8')).hexdigest()[:16]
+
+
+def load_delivered_index(username):
+    """Load the user's index of already delivered paystubs from /tmp, falling back to S3"""
+    key = session_cache_key(username)
+    path = os.path.join(DELIVERED_INDEX_DIR, f"{key}.json")
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.warning(f"⚠️ Ignoring unreadable delivered index: {e}")
+    
+    if DELIVERED_INDEX_BUCKET:
+        try:
+            s3 = aws_client('s3')
+            response = s3.get_object(Bucket=DELIVERED_INDEX_BUCKET, Key=f"delivered/{key}.json")
+            return json.loads(response['Body'].read())
+        except Exception as e:
+            log.debug(f"ℹ️ No delivered index in S3: {e}")
+    return {'documents': {}}
+
+
+def record_delivery(username, index, pdf_url, digest):
+    """Add a delivered paystub to the user's index and persist it"""
+    index.setdefault('documents', {})[document_id(pdf_url)] = {
+        'href': pdf_url,
+        'sha256': digest,
+        'delivered_at': int(time.time()),
+    }
+    key = session_cache_key(username)
+    body = json.dumps(index)
+    try:
+        os.makedirs(DELIVERED_INDEX_DIR, exist_ok=True)
+        with open(os.path.join(DELIVERED_INDEX_DIR, f"{key}.json"), 'w') as f:
+            f.write(body)
+    except Exception as e:
+        log.warning(f"⚠️ Failed to write delivered index: {e}")
+    
+    if DELIVERED_INDEX_BUCKET:
+        try:
+            s3 = aws_client('s3')
+            s3.put_object(Bucket=DELIVERED_INDEX_BUCKET, Key=f"delivered/{key}.json",
+                          Body=body, ContentType='application/json')
+        except Exception as e:
+            log.warning(f"⚠️ Failed to save delivered index to S3: {e}")
+
+
+def already_delivered(pdf_url, delivered_ids):
+    """True when the selected paystub is in the delivered index"""
+    if document_id(pdf_url) in delivered_ids:
+        log.info(f"📭 Newest paystub {document_id(pdf_url)} was already delivered")
+        return True
+    return False
+
+
+def find_paystub_links(page_html, base_url):
+    """Extract unique Document/GetFile links from earnings page HTML, newest first"""
+    links = []
+    for href in re.findall(r'href=["\']([^"\']*Document/GetFile[^"\']*)["\']', page_html, re.IGNORECASE):
+        url = urljoin(base_url, html.unescape(href))
+        if url not in links:
+            links.append(url)
+    return links
+
+
+def find_next_page(page_html, base_url):
+    """Return the absolute URL of an earnings history "next page" link, if any"""
+    match = (re.search(r'<a\b[^>]*\brel=["\']next["\'][^>]*\bhref=["\']([^"\']+)["\']', page_html, re.IGNORECASE)
+             or re.search(r'<a\b[^>]*\bhref=["\']([^"\']+)["\'][^>]*\brel=["\']next["\']', page_html, re.IGNORECASE)
+             or re.search(r'<a\b[^>]*\bhref=["\']([^"\'#]+)["\'][^>]*>\s*(?:Next|Older)\b', page_html, re.IGNORECASE))
+    return urljoin(base_url, html.unescape(match.group(1))) if match else None
+
+
+PdfFetch = namedtuple('PdfFetch', ['data', 'sha256', 'status', 'preview'])
+
+
+def fetch_pdf(session, pdf_url, referer=None):
+    """Stream a PDF over a pooled session, rejecting non-PDF bodies on the first chunk.
+    
+    Returns a PdfFetch whose data is None unless a complete PDF within
+    PDF_MAX_BYTES arrived; preview holds the first chunk for diagnostics.
+    """
+    import requests
+    
+    headers = {'Referer': referer} if referer else None
+    for attempt in range(PDF_RETRIES + 1):
+        try:
+            with session.get(pdf_url, headers=headers, allow_redirects=True,
+                             stream=True, timeout=PDF_TIMEOUT) as response:
+                if response.status_code >= 500 and attempt < PDF_RETRIES:
+                    log.warning(f"⚠️ HTTP {response.status_code} fetching PDF, retrying...")
+                    time.sleep(0.5 * (attempt + 1))
+                    continue
+                if response.status_code != 200:
+                    return PdfFetch(None, None, response.status_code, b'')
+                
+                declared = int(response.headers.get('Content-Length') or 0)
+                if declared > PDF_MAX_BYTES:
+                    log.error(f"❌ PDF is {declared} bytes, over the {PDF_MAX_BYTES} byte limit")
+                    return PdfFetch(None, None, response.status_code, b'')
+                
+                digest = hashlib.sha256()
+                chunks = []
+                size = 0
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if not chunk:
+                        continue
+                    if not chunks and not chunk.startswith(b'%PDF'):
+                        # HTML error or redirect page: stop before reading the rest
+                        return PdfFetch(None, None, response.status_code, chunk)
+                    size += len(chunk)
+                    if size > PDF_MAX_BYTES:
+                        log.error(f"❌ PDF exceeded the {PDF_MAX_BYTES} byte limit")
+                        return PdfFetch(None, None, response.status_code, (chunks or [chunk])[0])
+                    digest.update(chunk)
+                    chunks.append(chunk)
+                
+                if not chunks:
+                    return PdfFetch(None, None, response.status_code, b'')
+                return PdfFetch(b''.join(chunks), digest.hexdigest(), response.status_code, chunks[0])
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= PDF_RETRIES:
+                log.error(f"❌ Error downloading PDF: {e}")
+                return PdfFetch(None, None, None, b'')
+            log.warning(f"⚠️ {e.__class__.__name__} fetching PDF, retrying...")
+            time.sleep(0.5 * (attempt + 1))
+    return PdfFetch(None, None, None, b'')
+
+
+def cookies_from_session(session):
+    """Convert a requests cookie jar to Selenium-style cookie dicts for the session cache"""
+    return [
+        {'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path or '/'}
+        for c in session.cookies
+    ]
+
+
+class LoginFormParser(HTMLParser):
+    """Collect every form on a page with its action, method and input fields"""
+
+    def __init__(self):
+        super().__init__()
+        self.forms = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            self.forms.append({
+                'action': attrs.get('action') or '',
+                'method': (attrs.get('method') or 'post').lower(),
+                'inputs': [],
+            })
+        elif tag == 'input' and self.forms:
+            self.forms[-1]['inputs'].append({
+                'name': attrs.get('name'),
+                'id': attrs.get('id'),
+                'type': (attrs.get('type') or 'text').lower(),
+                'value': attrs.get('value') or '',
+            })
+
+
+LOGIN_ERROR_CLASSES = ('alert', 'error', 'invalid-feedback', 'validation-summary-errors', 'field-validation-error')
+VOID_TAGS = ('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'wbr')
+
+
+class LoginErrorParser(HTMLParser):
+    """Collect the text of error and validation-summary elements that are not hidden"""
+
+    def __init__(self):
+        super().__init__()
+        self.errors = []
+        self.depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+        if self.depth:
+            self.depth += 1
+            return
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        hidden = 'hidden' in attrs or 'display:none' in (attrs.get('style') or '').replace(' ', '')
+        if not hidden and any(c in LOGIN_ERROR_CLASSES for c in classes):
+            self.depth = 1
+            self.errors.append('')
+
+    def handle_endtag(self, tag):
+        if self.depth and tag not in VOID_TAGS:
+            self.depth -= 1
+
+    def handle_data(self, data):
+        if self.depth:
+            self.errors[-1] += data
+
+
+def find_login_errors(page_html):
+    """Non-empty error messages rendered in a page's HTML, like query_page's errors without a browser"""
+    parser = LoginErrorParser()
+    parser.feed(page_html)
+    return [' '.join(text.split()) for text in parser.errors if text.strip()]
+
+
+def build_login_payload(page_html, username, password):
+    """Find the login form and return (action, fields) with credentials and anti-forgery token filled"""
+    parser = LoginFormParser()
+    parser.feed(page_html)
+    
+    for form in parser.forms:
+        inputs = [i for i in form['inputs'] if i['name']]
+        password_inputs = [i for i in inputs if i['type'] == 'password']
+        if not password_inputs:
+            continue
+        
+        user_inputs = [i for i in inputs if i['id'] == 'employee-num']
+        if not user_inputs:
+            user_inputs = [i for i in inputs if i['type'] in ('text', 'number', 'tel')
+                           and 'employee' in i['name'].lower()]
+        if not user_inputs:
+            continue
+        
+        # Hidden fields carry __RequestVerificationToken and the login mode
+        fields = {i['name']: i['value'] for i in inputs
+                  if i['type'] == 'hidden' or (i['type'] in ('checkbox', 'radio') and i['value'])}
+        fields[user_inputs[0]['name']] = username
+        fields[password_inputs[0]['name']] = password
+        return form['action'], fields
+    return None, None
+
+
+class LoginRejected(Exception):
+    """Viewpoint refused the username or password, so no other login engine should retry it"""
+
+
+def http_login(username, password):
+    """Log in over plain HTTP; returns (session, earnings response) or None.
+    
+    Raises LoginRejected when the form was posted and Viewpoint answered
+    with a credential error, so a wrong password is only tried once.
+    """
+    log.debug("⚡ Trying browserless HTTP login...")
+    try:
+        session = session_from_cookies([])
+        session.headers['Accept'] = 'text/html,application/xhtml+xml,application/pdf,*/*'
+        
+        response = session.get(current_tenant().login_url, timeout=30)
+        if response.status_code != 200:
+            log.warning(f"⚠️ Login page returned HTTP {response.status_code}")
+            return None
+        
+        action, fields = build_login_payload(response.text, username, password)
+        if fields is None:
+            log.warning("⚠️ No usable login form in page HTML")
+            return None
+        if '__RequestVerificationToken' not in fields:
+            log.debug("ℹ️ Login form has no anti-forgery token")
+        
+        with span('login_submit'):
+            response = session.post(
+                urljoin(response.url, action) if action else response.url,
+                data=fields,
+                headers={'Referer': response.url, 'Origin': current_tenant().origin},
+                allow_redirects=True,
+                timeout=30
+            )
+        if "login" in response.url.lower():
+            errors = find_login_errors(response.text)
+            if errors:
+                log.warning(f"⚠️ HTTP login rejected: {errors[0]}")
+                raise LoginRejected(username)
+            log.warning("⚠️ HTTP login was not accepted")
+            return None
+        
+        with span('earnings_navigation'):
+            response = session.get(current_tenant().earnings_url, allow_redirects=True, timeout=30)
+        if response.status_code != 200 or "login" in response.url.lower():
+            log.warning("⚠️ Earnings page not reachable after HTTP login")
+            return None
+        log.info("✅ Logged in over HTTP")
+        save_cached_cookies(username, cookies_from_session(session))
+        return session, response
+    except LoginRejected:
+        raise
+    except Exception as e:
+        log.warning(f"⚠️ HTTP login failed: {e}")
+        return None
+
+
+def download_latest(opened, delivered_ids, how):
+    """Fetch the newest paystub from an authenticated earnings page over HTTP; None if that fails"""
+    session, response = opened
+    try:
+        links = find_paystub_links(response.text, response.url)
+        if not links:
+            log.debug("ℹ️ Earnings page has no static paystub links")
+            return None
+        
+        log.info(f"📎 Selected PDF URL: {links[0]}")
+        if already_delivered(links[0], delivered_ids):
+            return {'url': links[0], 'pdf': None}
+        with span('download_http'):
+            pdf = fetch_pdf(session, links[0], referer=response.url)
+        if not pdf.data:
+            return None
+        log.info(f"✅ Downloaded PDF {how}, size: {len(pdf.data)} bytes")
+        return {'url': links[0], 'pdf': pdf.data, 'sha256': pdf.sha256}
+    except Exception as e:
+        log.warning(f"⚠️ Download {how} failed: {e}")
+        return None
+
+
+@timed('http_login')
+def http_login_and_download(username, password, delivered_ids=()):
+    """Log in and fetch the latest paystub over plain HTTP, without a browser.
+    
+    Returns (paystub, session): the session stays usable by the browser
+    when it is logged in but the paystub could not be fetched over HTTP.
+    """
+    opened = http_login(username, password)
+    if not opened:
+        return None, None
+    return download_latest(opened, delivered_ids, 'over HTTP'), opened[0]
+
+
+def cached_session(username):
+    """Reopen a cached cookie jar; returns (session, earnings response) while it is still valid"""
+    if not SESSION_CACHE_ENABLED:
+        return None
+    cookies = load_cached_cookies(username)
+    if not cookies:
+        return None
+    
+    log.debug("🍪 Probing earnings page with cached session...")
+    try:
+        session = session_from_cookies(cookies)
+        response = session.get(current_tenant().earnings_url, allow_redirects=True, timeout=30)
+        if response.status_code != 200 or "login" in response.url.lower():
+            log.debug("⌛ Cached session expired")
+            drop_cached_cookies(username)
+            return None
+        return session, response
+    except Exception as e:
+        log.warning(f"⚠️ Cached session probe failed: {e}")
+        return None
+
+
+@timed('cached_session')
+def download_with_cached_session(username, delivered_ids=()):
+    """Try the latest paystub with a cached cookie jar over plain HTTP; returns (paystub, session)"""
+    opened = cached_session(username)
+    if not opened:
+        return None, None
+    return download_latest(opened, delivered_ids, 'with cached session'), opened[0]
+
+
+# Fetches a URL with the page's own cookies and connection and hands the
+# body back base64-encoded, since WebDriver can only return JSON values
+PAGE_FETCH_SCRIPT = """
+    var url = arguments[0], maxBytes = arguments[1], done = arguments[arguments.length - 1];
+    fetch(url, {credentials: 'include', headers: {'Accept': 'application/pdf,*/*'}})
+        .then(function (response) {
+            var type = response.headers.get('Content-Type') || '';
+            var result = {status: response.status, type: type, url: response.url};
+            if (+response.headers.get('Content-Length') > maxBytes) {
+                result.error = 'larger than ' + maxBytes + ' bytes';
+                return done(result);
+            }
+            return response.blob().then(function (blob) {
+                if (blob.size > maxBytes) {
+                    result.error = 'larger than ' + maxBytes + ' bytes';
+                    return done(result);
+                }
+                var reader = new FileReader();
+                reader.onload = function () {
+                    result.data = reader.result.split(',', 2)[1] || '';
+                    done(result);
+                };
+                reader.onerror = function () { done({error: String(reader.error)}); };
+                reader.readAsDataURL(blob);
+            });
+        })
+        .catch(function (e) { done({error: String(e)}); });
+"""
+
+
+@timed('download_in_page')
+def download_pdf_in_page(driver, pdf_url):
+    """Fetch the PDF from inside the authenticated page, over the browser's own connection and cookies"""
+    log.debug("📥 Fetching PDF inside the page...")
+    try:
+        fetched = driver.execute_async_script(PAGE_FETCH_SCRIPT, pdf_url, PDF_MAX_BYTES) or {}
+    except Exception as e:
+        log.warning(f"⚠️ In-page fetch failed: {e}")
+        return None
+    if fetched.get('error'):
+        log.warning(f"⚠️ In-page fetch failed: {fetched['error']} (HTTP {fetched.get('status')})")
+        return None
+    
+    pdf_data = base64.b64decode(fetched.get('data') or '')
+    if fetched.get('status') != 200 or not pdf_data.startswith(b'%PDF'):
+        log.warning(f"⚠️ In-page fetch returned HTTP {fetched.get('status')} {fetched.get('type')!r}, not a PDF")
+        return None
+    log.info(f"✅ Downloaded PDF inside the page, size: {len(pdf_data)} bytes")
+    return pdf_data
+
+
+@timed('download_session')
+def download_pdf_with_session(driver, pdf_url):
+    """Download PDF using requests with session cookies from Selenium"""
+    from selenium.webdriver.common.by import By
+    
+    log.debug("📥 Downloading PDF with session...")
+    
+    # Create requests session with all cookies from Selenium
+    session = session_from_cookies(driver.get_cookies())
     
     # Try to download the PDF
     try:
-        response = session.get(pdf_url, allow_redirects=True, timeout=30)
+        pdf = fetch_pdf(session, pdf_url, referer=driver.current_url)
         
-        if response.status_code == 200:
-            content = response.content
+        if pdf.status == 200:
+            content = pdf.preview
             
             # Check if it's actually a PDF
-            if content.startswith(b'%PDF'):
-                print(f"✅ Downloaded valid PDF, size: {len(content)} bytes")
-                return content
+            if pdf.data:
+                log.info(f"✅ Downloaded valid PDF, size: {len(pdf.data)} bytes")
+                return pdf.data
             else:
                 # Sometimes the server returns HTML with a meta refresh or JavaScript redirect
-                print("⚠️ Got HTML instead of PDF, trying alternative approach...")
+                log.warning("⚠️ Got HTML instead of PDF, trying alternative approach...")
                 
                 # Check if there's a redirect in the HTML
                 if b'window.location' in content or b'meta http-equiv="refresh"' in content:
-                    print("📍 Found redirect in HTML, following it...")
+                    log.debug("📍 Found redirect in HTML, following it...")
                     
                     # Use Selenium to navigate and wait for the actual PDF
-                    driver.get(pdf_url)
-                    time.sleep(3)
+                    with span('download_session_redirect'):
+                        driver.get(pdf_url)
+                        wait_for(driver, redirect_settled(pdf_url), timeout=3)
                     
-                    # Try to find the actual PDF URL in the page
-                    try:
+                    def from_iframe():
                         # Look for iframe or embed with PDF
-                        pdf_elements = driver.find_elements(By.CSS_SELECTOR, "iframe[src*='.pdf'], embed[src*='.pdf'], object[data*='.pdf']")
-                        if pdf_elements:
-                            actual_pdf_url = pdf_elements[0].get_attribute('src') or pdf_elements[0].get_attribute('data')
-                            print(f"📎 Found actual PDF URL: {actual_pdf_url}")
-                            
-                            # Download the actual PDF
-                            response = session.get(actual_pdf_url, allow_redirects=True)
-                            if response.status_code == 200 and response.content.startswith(b'%PDF'):
-                                print(f"✅ Downloaded valid PDF from iframe, size: {len(response.content)} bytes")
-                                return response.content
-                    except:
-                        pass
+                        pdf_elements = driver.find_elements(By.CSS_SELECTOR, PDF_SELECTOR)
+                        if not pdf_elements:
+                            return None
+                        actual_pdf_url = pdf_elements[0].get_attribute('src') or pdf_elements[0].get_attribute('data')
+                        log.info(f"📎 Found actual PDF URL: {actual_pdf_url}")
+                        with span('download_session_iframe'):
+                            return fetch_pdf(session, actual_pdf_url, referer=driver.current_url).data
                     
-                    # Last resort: get the current URL after redirects
-                    current_url = driver.current_url
-                    if current_url != pdf_url:
-                        print(f"📍 Redirected to: {current_url}")
-                        response = session.get(current_url, allow_redirects=True)
-                        if response.status_code == 200 and response.content.startswith(b'%PDF'):
-                            print(f"✅ Downloaded valid PDF from redirect, size: {len(response.content)} bytes")
-                            return response.content
+                    def from_redirect():
+                        # The URL the browser ended up on after redirects
+                        current_url = driver.current_url
+                        if current_url == pdf_url:
+                            return None
+                        log.debug(f"📍 Redirected to: {current_url}")
+                        with span('download_session_redirect'):
+                            return fetch_pdf(session, current_url, referer=pdf_url).data
+                    
+                    pdf_data = strategy_registry.run('session_fallback', [
+                        ('iframe', from_iframe),
+                        ('redirect', from_redirect),
+                    ])
+                    if pdf_data:
+                        log.info(f"✅ Downloaded valid PDF after redirect, size: {len(pdf_data)} bytes")
+                        return pdf_data
                 
-                print("❌ Could not get PDF content")
+                log.error("❌ Could not get PDF content")
                 return None
         else:
-            print(f"❌ HTTP error: {response.status_code}")
+            log.error(f"❌ HTTP error: {pdf.status}")
             return None
             
     except Exception as e:
-        print(f"❌ Error downloading PDF: {e}")
+        log.error(f"❌ Error downloading PDF: {e}")
         return None
     
 
-def setup_driver():
+WORKSPACE_DIR = os.environ.get('WORKSPACE_DIR', '/tmp')
+WORKSPACE_QUOTA_MB = int(os.environ.get('WORKSPACE_QUOTA_MB', '384'))
+BROWSER_CACHE_MB = int(os.environ.get('BROWSER_CACHE_MB', '64'))
+
+# Per-slot directories; the chrome-* ones outlive the driver so recycled
+# or restarted Chrome finds Viewpoint's JS and CSS already cached
+SLOT_BROWSER_DIRS = ('chrome-user-data', 'chrome-data-path', 'chrome-cache')
+SLOT_SCRATCH_DIRS = ('downloads', 'artifacts')
+
+workspace_lock = threading.Lock()
+workspace_last_used = {}
+busy_slots = set()  # slots with a user in progress; their workspace is never evicted
+
+
+def workspace_dir(kind, slot=None):
+    """A per-slot workspace directory (the current worker's slot by default)"""
+    if slot is None:
+        slot = getattr(worker_state, 'slot', 0)
+    return os.path.join(WORKSPACE_DIR, f"{kind}-{slot}")
+
+
+def artifact_path(name):
+    """Path for a debug artifact of the current user, created on demand"""
+    directory = workspace_dir('artifacts')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def path_size(path):
+    """Bytes used by a file or a directory tree"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def remove_path(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def list_dir(path):
+    """Entries of a directory, or none if it is missing or being removed"""
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def clear_slot_scratch(keep_artifacts=False):
+    """Remove the current slot's browser downloads and, unless kept, its artifacts"""
+    with workspace_lock:
+        for kind in SLOT_SCRATCH_DIRS:
+            if kind == 'artifacts' and keep_artifacts:
+                continue
+            directory = workspace_dir(kind)
+            for name in list_dir(directory):
+                remove_path(os.path.join(directory, name))
+
+
+def mark_slot_busy(slot, busy):
+    """Record whether a slot has a user in progress, for enforce_workspace_quota"""
+    with workspace_lock:
+        if busy:
+            busy_slots.add(slot)
+        else:
+            busy_slots.discard(slot)
+            workspace_last_used[slot] = time.time()
+
+
+def enforce_workspace_quota():
+    """Evict least recently used workspace data until it fits WORKSPACE_QUOTA_MB.
+    
+    Chrome bounds its own disk cache (BROWSER_CACHE_MB, LRU). Here kept
+    artifacts and downloads go first, oldest first, then the browser
+    directories of idle slots with no running Chrome, least recently
+    used first. Other slots' users in progress are never touched.
+    """
+    own_slot = getattr(worker_state, 'slot', 0)
+    with workspace_lock:
+        running = {slot for slot, manager in list(driver_managers.items()) if manager.driver is not None}
+        candidates, used = [], 0
+        for entry in list_dir(WORKSPACE_DIR):
+            kind, _, slot = entry.rpartition('-')
+            if not slot.isdigit():
+                continue
+            slot = int(slot)
+            idle = slot not in busy_slots
+            path = os.path.join(WORKSPACE_DIR, entry)
+            if kind in SLOT_SCRATCH_DIRS:
+                for name in list_dir(path):
+                    item = os.path.join(path, name)
+                    try:
+                        size, modified = path_size(item), os.path.getmtime(item)
+                    except OSError:
+                        continue  # removed while scanning
+                    used += size
+                    if idle or slot == own_slot:
+                        candidates.append((0, modified, item, size))
+            elif kind in SLOT_BROWSER_DIRS:
+                size = path_size(path)
+                used += size
+                if idle and slot not in running:
+                    candidates.append((1, workspace_last_used.get(slot, 0), path, size))
+        
+        quota = WORKSPACE_QUOTA_MB * MB
+        if used <= quota:
+            return
+        evicted = 0
+        for _, _, path, size in sorted(candidates):
+            if used <= quota:
+                break
+            remove_path(path)
+            used -= size
+            evicted += size
+        log.info(f"🧹 Workspace over {WORKSPACE_QUOTA_MB} MB, evicted {evicted / MB:.1f} MB")
+        if used > quota:
+            log.warning(f"⚠️ Workspace still uses {used / MB:.1f} MB; busy slots and running browsers are kept")
+
+
+@timed('setup_driver')
+def setup_driver(slot=0):
     """Setup Chrome driver with Lambda-compatible options"""
-    print("🔧 Setting up Chrome driver...")
+    log.debug(f"🔧 Setting up Chrome driver (slot {slot})...")
+    webdriver = lazy_import('selenium.webdriver')
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
     
     options = Options()
     options.binary_location = '/opt/chrome/chrome'
@@ -128,10 +1424,12 @@ def setup_driver():
     options.add_argument('--disable-dev-tools')
     options.add_argument('--no-zygote')
     options.add_argument('--single-process')
-    options.add_argument('--user-data-dir=/tmp/chrome-user-data')
-    options.add_argument('--data-path=/tmp/chrome-data-path')
-    options.add_argument('--disk-cache-dir=/tmp/chrome-cache')
-    options.add_argument('--remote-debugging-port=9222')
+    # Each worker slot gets its own profile, cache and debugging port
+    options.add_argument(f"--user-data-dir={workspace_dir('chrome-user-data', slot)}")
+    options.add_argument(f"--data-path={workspace_dir('chrome-data-path', slot)}")
+    options.add_argument(f"--disk-cache-dir={workspace_dir('chrome-cache', slot)}")
+    options.add_argument(f'--disk-cache-size={BROWSER_CACHE_MB * MB}')
+    options.add_argument(f'--remote-debugging-port={9222 + slot}')
     
     # Add more options for stability
     options.add_argument('--disable-software-rasterizer')
@@ -148,19 +1446,448 @@ def setup_driver():
     # Set window size to ensure elements are visible
     options.add_argument('--window-size=1920,1080')
     
+    # Browser downloads land in the slot's own directory, cleared between users
+    downloads = workspace_dir('downloads', slot)
+    os.makedirs(downloads, exist_ok=True)
+    prefs = {'download.default_directory': downloads}
+    if LEAN_BROWSER:
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        prefs.update({
+            'profile.managed_default_content_settings.images': 2,
+            'profile.default_content_setting_values.notifications': 2,
+        })
+    options.add_experimental_option('prefs', prefs)
+    
     service = Service('/opt/chromedriver')
     
     try:
         driver = webdriver.Chrome(service=service, options=options)
-        print("✅ Chrome driver created successfully")
+        driver.set_script_timeout(PDF_TIMEOUT)
+        try:
+            # Headless Chrome ignores the download pref without this
+            driver.execute_cdp_cmd('Page.setDownloadBehavior', {'behavior': 'allow', 'downloadPath': downloads})
+        except Exception as e:
+            log.warning(f"⚠️ Could not set download directory: {e}")
+        if LEAN_BROWSER:
+            apply_lean_profile(driver)
+        log.info("✅ Chrome driver created successfully")
         return driver
-    except Exception as e:
-        print(f"❌ Failed to create Chrome driver: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        log.exception("❌ Failed to create Chrome driver")
         raise
 
+
+def debug_enabled():
+    """Debug artifacts are on globally or for the user being processed"""
+    return DEBUG_ARTIFACTS or getattr(worker_state, 'debug', False)
+
+
+def capture_artifacts(driver, name, failure=True):
+    """Save a screenshot and page source to the workspace, only on failure or in debug mode"""
+    if not failure and not debug_enabled():
+        return True
+    try:
+        driver.save_screenshot(artifact_path(f"{name}.png"))
+        with open(artifact_path(f"{name}.html"), 'w') as f:
+            f.write(driver.page_source)
+        log.info(f"📸 Saved {artifact_path(name)}.png and .html")
+        return True
+    except Exception as e:
+        log.warning(f"⚠️ Could not capture {name}: {e}")
+        return False
+
+
+def apply_lean_profile(driver):
+    """Block images, fonts, media and third-party trackers through the DevTools protocol"""
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+    except Exception as e:
+        log.warning(f"⚠️ Could not enable resource blocking: {e}")
+
+
+STEP_TIMEOUT = float(os.environ.get('STEP_TIMEOUT', '15'))
+PDF_SELECTOR = "iframe[src*='.pdf'], embed[src*='.pdf'], object[data*='.pdf']"
+PAYSTUB_LINK_SELECTOR = "a[href*='Document/GetFile']"
+FALLBACK_LINK_SELECTOR = "a[href*='document'], a[href*='pdf'], a[href*='download']"
+ERROR_SELECTOR = ".alert, .error, .invalid-feedback, .validation-summary-errors"
+
+# Collects everything link discovery and error checks need in one round-trip
+PAGE_QUERY_SCRIPT = """
+    var linkSelector = arguments[0], errorSelector = arguments[1];
+    var datePattern = /(\\d{1,2}\\/\\d{1,2}\\/\\d{2,4}|\\d{4}-\\d{2}-\\d{2})/;
+    var seen = {}, links = [], errors = [];
+    document.querySelectorAll(linkSelector).forEach(function (a) {
+        if (!a.href || seen[a.href]) return;
+        seen[a.href] = true;
+        var row = a.closest('tr, li') || a.parentElement;
+        var date = row && row.textContent.match(datePattern);
+        links.push({href: a.href, text: a.textContent.trim(), date: date ? date[1] : null});
+    });
+    document.querySelectorAll(errorSelector).forEach(function (e) {
+        var text = e.textContent.trim();
+        if (text && e.offsetParent !== null) errors.push(text);
+    });
+    return {url: location.href, links: links, errors: errors};
+"""
+
+
+def query_page(driver, link_selector=PAYSTUB_LINK_SELECTOR):
+    """Unique links (href, text, date) in page order and visible error messages, in one WebDriver call"""
+    return driver.execute_script(PAGE_QUERY_SCRIPT, link_selector, ERROR_SELECTOR)
+
+
+def document_ready(driver):
+    """The current document has finished loading"""
+    return driver.execute_script("return document.readyState;") == "complete"
+
+
+def form_interactive(driver):
+    """The employee-number login form is rendered, visible and editable"""
+    return driver.execute_script("""
+        var user = document.getElementById('employee-num');
+        var pass = document.getElementById('password');
+        var submit = document.querySelector("button[type='submit']");
+        return !!(user && pass && submit && user.offsetParent !== null && !user.disabled && !user.readOnly);
+    """)
+
+
+def submit_enabled(driver):
+    """Client-side validation has enabled the submit button"""
+    return driver.execute_script(
+        "var b = document.querySelector(\"button[type='submit']\"); return !!(b && !b.disabled);"
+    )
+
+
+def login_settled(driver):
+    """Login finished: either we left the login page or an error message is showing"""
+    if "login" not in driver.current_url.lower():
+        return True
+    return driver.execute_script("""
+        return Array.prototype.some.call(
+            document.querySelectorAll('.alert, .error, .invalid-feedback, .validation-summary-errors'),
+            function (e) { return e.offsetParent !== null && e.textContent.trim(); });
+    """)
+
+
+# Installed on the login page before each submit attempt: notes when the
+# page starts navigating away and counts fetch/XHR requests still running
+SUBMIT_WATCH_SCRIPT = """
+    if (window.__submitWatch) return;
+    var watch = window.__submitWatch = {leaving: false, pending: 0};
+    window.addEventListener('beforeunload', function () { watch.leaving = true; });
+    var done = function () { watch.pending--; };
+    if (window.fetch) {
+        var fetch = window.fetch;
+        window.fetch = function () {
+            watch.pending++;
+            return fetch.apply(this, arguments).finally(done);
+        };
+    }
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        watch.pending++;
+        this.addEventListener('loadend', done);
+        return send.apply(this, arguments);
+    };
+"""
+
+
+def login_form_idle(driver):
+    """Still on the login form with no navigation or request in flight, so another submit method may try"""
+    if "login" not in driver.current_url.lower():
+        return False
+    return driver.execute_script("""
+        var watch = window.__submitWatch;
+        return !!(watch && !watch.leaving && watch.pending <= 0 && document.readyState === 'complete');
+    """)
+
+
+def links_present(driver):
+    """At least one paystub link is in the DOM"""
+    return driver.execute_script("return !!document.querySelector(arguments[0]);", PAYSTUB_LINK_SELECTOR)
+
+
+def redirect_settled(pdf_url):
+    """Condition: a GetFile page has redirected away or embedded the PDF"""
+    def condition(driver):
+        from selenium.webdriver.common.by import By
+        return driver.current_url != pdf_url or len(driver.find_elements(By.CSS_SELECTOR, PDF_SELECTOR)) > 0
+    condition.__name__ = 'redirect_settled'
+    return condition
+
+
+def pdf_downloaded(since):
+    """Condition: Chrome has written a new PDF into the slot's downloads after `since`"""
+    def condition(driver):
+        return any(os.path.getctime(f) >= since for f in glob.glob(os.path.join(workspace_dir('downloads'), '*.pdf')))
+    condition.__name__ = 'pdf_downloaded'
+    return condition
+
+
+def wait_for(driver, condition, timeout=STEP_TIMEOUT, poll=0.1):
+    """Wait until a named condition holds or its step budget runs out; True if it held"""
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+    
+    started = time.time()
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=poll).until(condition)
+        log.debug(f"⏱️ {condition.__name__} after {time.time() - started:.2f}s")
+        return True
+    except TimeoutException:
+        log.debug(f"⌛ {condition.__name__} not met within {timeout}s")
+        return False
+
+
+DRIVER_MAX_USES = int(os.environ.get('DRIVER_MAX_USES', '20'))
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', '1'))
+
+
+class DriverManager:
+    """Keep one Chrome/ChromeDriver alive across warm Lambda invocations"""
+
+    def __init__(self, slot=0, max_uses=DRIVER_MAX_USES):
+        self.slot = slot
+        self.max_uses = max_uses
+        self.driver = None
+        self.uses = 0
+        self.tenant = None  # whose origin the browser was last used on
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Return a healthy, clean driver, starting or recycling Chrome if needed"""
+        with self.lock:
+            if self.driver is not None and self.uses >= self.max_uses:
+                log.info(f"♻️ Recycling Chrome after {self.uses} uses")
+                self.shutdown()
+            if self.driver is not None and not self.is_healthy():
+                log.warning("⚠️ Warm Chrome failed health check, restarting...")
+                self.shutdown()
+            if self.driver is None:
+                self.driver = setup_driver(self.slot)
+                self.uses = 0
+            else:
+                log.debug(f"♨️ Reusing warm Chrome (use {self.uses + 1} of {self.max_uses})")
+            if self.tenant is not None and self.tenant != current_tenant():
+                log.debug(f"🔧 Switching Chrome from {self.tenant.host} to {current_tenant().host}")
+            self.tenant = current_tenant()
+            self.uses += 1
+            return self.driver
+
+    def release(self, healthy=True):
+        """Reset browser state for the next user, or drop the driver if it crashed"""
+        with self.lock:
+            if self.driver is None:
+                return
+            if not healthy or not self.reset_state():
+                self.shutdown()
+
+    def is_healthy(self):
+        """Check the browser still answers commands"""
+        try:
+            self.driver.execute_script("return 1;")
+            return len(self.driver.window_handles) > 0
+        except Exception as e:
+            log.warning(f"⚠️ Chrome health check failed: {e}")
+            return False
+
+    def reset_state(self):
+        """Close extra tabs and clear cookies and storage left by the previous user"""
+        driver = self.driver
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            driver.delete_all_cookies()
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+                'origin': (self.tenant or DEFAULT_TENANT).origin,
+                'storageTypes': 'all',
+            })
+            driver.get('about:blank')
+            return True
+        except Exception as e:
+            log.warning(f"⚠️ Failed to reset Chrome state: {e}")
+            return False
+
+    def service_pid(self):
+        """PID of the running ChromeDriver, the root of this slot's browser processes"""
+        process = getattr(getattr(self.driver, 'service', None), 'process', None)
+        return getattr(process, 'pid', None)
+
+    def shutdown(self):
+        """Quit Chrome if it is running"""
+        if self.driver is None:
+            return
+        try:
+            self.driver.quit()
+            log.info("🔚 Chrome driver closed")
+        except:
+            pass
+        self.driver = None
+        self.uses = 0
+        self.tenant = None
+
+
+driver_managers = {}
+driver_managers_lock = threading.Lock()
+
+
+def get_driver_manager(slot=None):
+    """Return the warm driver manager for a worker slot (the current thread's by default)"""
+    if slot is None:
+        slot = getattr(worker_state, 'slot', 0)
+    with driver_managers_lock:
+        if slot not in driver_managers:
+            driver_managers[slot] = DriverManager(slot)
+        return driver_managers[slot]
+
+
+def assign_worker_slot(slots):
+    """Thread pool initializer: bind each worker thread to its own browser slot"""
+    worker_state.slot = slots.get_nowait()
+
+
+# Optionally launch Chrome during the Lambda init phase instead of on first use
+if os.environ.get('BROWSER_PREWARM') == '1':
+    prewarm_started = time.perf_counter()
+    try:
+        get_driver_manager(0).acquire()
+        get_driver_manager(0).release()
+    except Exception as e:
+        log.warning(f"⚠️ Chrome prewarm failed: {e}")
+    INIT_REPORT['prewarm_ms'] = round((time.perf_counter() - prewarm_started) * 1000, 1)
+
+STRATEGY_STATS_PATH = os.environ.get('STRATEGY_STATS_PATH', '/tmp/strategy-stats.json')
+STRATEGY_STATS_BUCKET = os.environ.get('STRATEGY_STATS_BUCKET')
+STRATEGY_SKIP_AFTER = int(os.environ.get('STRATEGY_SKIP_AFTER', '3'))
+STRATEGY_RETRY_SECONDS = float(os.environ.get('STRATEGY_RETRY_SECONDS', '3600'))
+
+
+class StrategyRegistry:
+    """Success rate and latency of interchangeable fallback strategies, tried best-first.
+    
+    Stats are kept per group (e.g. "submit", "download") as exponentially
+    weighted success rate and latency, so a strategy that breaks drops
+    quickly. One that failed STRATEGY_SKIP_AFTER times in a row is skipped
+    until STRATEGY_RETRY_SECONDS have passed, unless every strategy in the
+    group would be skipped.
+    """
+    ALPHA = 0.3
+
+    def __init__(self, path=STRATEGY_STATS_PATH, bucket=STRATEGY_STATS_BUCKET):
+        self.path = path
+        self.bucket = bucket
+        self.lock = threading.Lock()
+        self.stats = None
+        self.dirty = False
+
+    def load(self):
+        """Read stats from /tmp, falling back to S3, once per container"""
+        if self.stats is not None:
+            return
+        try:
+            with open(self.path) as f:
+                self.stats = json.load(f)
+            return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning(f"⚠️ Ignoring unreadable strategy stats: {e}")
+        self.stats = {}
+        if self.bucket:
+            try:
+                response = aws_client('s3').get_object(Bucket=self.bucket, Key='strategy-stats.json')
+                self.stats = json.loads(response['Body'].read())
+            except Exception as e:
+                log.debug(f"ℹ️ No strategy stats in S3: {e}")
+
+    def save(self):
+        """Persist stats changed since the last save"""
+        with self.lock:
+            if not self.dirty:
+                return
+            body = json.dumps(self.stats)
+            self.dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                f.write(body)
+            os.replace(self.path + '.tmp', self.path)
+            if self.bucket:
+                aws_client('s3').put_object(Bucket=self.bucket, Key='strategy-stats.json',
+                                            Body=body.encode('utf-8'), ContentType='application/json')
+        except Exception as e:
+            log.warning(f"⚠️ Failed to save strategy stats: {e}")
+
+    def order(self, group, names):
+        """Return the names to try, best first, leaving out ones that keep failing"""
+        with self.lock:
+            self.load()
+            stats = self.stats.get(group, {})
+        now = time.time()
+
+        def key(item):
+            index, name = item
+            s = stats.get(name, {})
+            return (-round(s.get('rate', 0.5), 1), s.get('latency_ms', 0.0), index)
+
+        ranked = [name for _, name in sorted(enumerate(names), key=key)]
+        usable = [name for name in ranked
+                  if stats.get(name, {}).get('failures', 0) < STRATEGY_SKIP_AFTER
+                  or now - stats[name].get('failed_at', 0) >= STRATEGY_RETRY_SECONDS]
+        skipped = [name for name in ranked if name not in usable]
+        if skipped and usable:
+            log.info(f"⏭️ Skipping {group} strategies that keep failing: {', '.join(skipped)}")
+        return usable or ranked
+
+    def record(self, group, name, ok, elapsed_ms):
+        """Record an attempt; ok=None means slow and inconclusive, which counts toward latency only"""
+        with self.lock:
+            self.load()
+            s = self.stats.setdefault(group, {}).setdefault(name, {'rate': 0.5, 'attempts': 0})
+            s['attempts'] += 1
+            s['latency_ms'] = elapsed_ms if 'latency_ms' not in s else \
+                (1 - self.ALPHA) * s['latency_ms'] + self.ALPHA * elapsed_ms
+            if ok is None:
+                s['slow'] = s.get('slow', 0) + 1
+                self.dirty = True
+                return
+            s['rate'] = (1 - self.ALPHA) * s['rate'] + self.ALPHA * (1.0 if ok else 0.0)
+            if ok:
+                s['failures'] = 0
+            else:
+                s['failures'] = s.get('failures', 0) + 1
+                s['failed_at'] = time.time()
+            self.dirty = True
+
+    def run(self, group, strategies, accept=bool):
+        """Try (name, func) strategies best-first; return the first result `accept` allows, or None"""
+        funcs = dict(strategies)
+        for name in self.order(group, [name for name, _ in strategies]):
+            started = time.perf_counter()
+            try:
+                result = funcs[name]()
+            except Exception as e:
+                log.warning(f"⚠️ {group} strategy {name} failed: {e}")
+                result = None
+            ok = bool(accept(result))
+            self.record(group, name, ok, (time.perf_counter() - started) * 1000)
+            if ok:
+                return result
+        return None
+
+
+strategy_registry = StrategyRegistry()
+
+
 def wait_and_click(driver, element, use_js=False):
     """Click an element, using JavaScript if necessary"""
+    from selenium.common.exceptions import ElementClickInterceptedException
+    
     try:
         if use_js:
             driver.execute_script("arguments[0].click();", element)
@@ -168,337 +1895,591 @@ def wait_and_click(driver, element, use_js=False):
             element.click()
         return True
     except ElementClickInterceptedException:
-        print("⚠️ Regular click intercepted, trying JavaScript click...")
+        log.warning("⚠️ Regular click intercepted, trying JavaScript click...")
         driver.execute_script("arguments[0].click();", element)
         return True
 
-def login_and_download(username, password):
-    """Login to Viewpoint and download the latest paystub"""
-    print(f"👤 Logging in as {username}")
-    driver = None
+def login_and_download(username, password, delivered_ids=()):
+    """Login to Viewpoint and download the latest paystub.
+    
+    Returns {'url': ..., 'pdf': bytes}, with 'pdf' None when the newest
+    paystub is in delivered_ids, or None if nothing could be downloaded.
+    Raises LoginRejected when Viewpoint refuses the credentials.
+    """
+    log.info(f"👤 Logging in as {username}")
+    paystub, session = download_with_cached_session(username, delivered_ids)
+    if paystub:
+        return paystub
     
+    if session is None and LOGIN_ENGINE in ('auto', 'http'):
+        paystub, session = http_login_and_download(username, password, delivered_ids)
+        if paystub:
+            return paystub
+    if LOGIN_ENGINE == 'http':
+        return None
+    
+    # An authenticated session carries over to the browser instead of a second login
+    if session is not None:
+        log.info("↩️ Continuing in Selenium with the authenticated session")
+        return selenium_login_and_download(username, password, delivered_ids, cookies_from_session(session))
+    log.info("↩️ Falling back to Selenium login")
+    return selenium_login_and_download(username, password, delivered_ids)
+
+def selenium_login(driver, username, password):
+    """Log in through the Viewpoint form in the browser; True once the earnings page is reachable"""
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+    
+    wait = WebDriverWait(driver, 15)
+    
+    login_url = current_tenant().login_url
+    log.debug(f"🌐 Navigating to login page: {login_url}")
+    driver.get(login_url)
+    log.debug(f"📍 Current URL: {driver.current_url}")
+    log.debug(f"📄 Page title: {driver.title}")
+    
+    # Take screenshot for debugging
+    capture_artifacts(driver, "login_page", failure=False)
+    
+    # Click employee number option
+    log.debug("🔍 Looking for employee number option...")
     try:
-        driver = setup_driver()
-        wait = WebDriverWait(driver, 15)
-        
-        # Test that Chrome is working
-        print("🌐 Testing Chrome with Google...")
-        driver.get("https://www.google.com")
-        print(f"✅ Chrome working, title: {driver.title}")
-        
-        print(f"🌐 Navigating to login page: {VP_LOGIN_URL}")
-        driver.get(VP_LOGIN_URL)
-        print(f"📍 Current URL: {driver.current_url}")
-        print(f"📄 Page title: {driver.title}")
-        
-        # Take screenshot for debugging
-        screenshot_path = "/tmp/login_page.png"
-        driver.save_screenshot(screenshot_path)
-        print(f"📸 Screenshot saved to {screenshot_path}")
-        
-        # Click employee number option
-        print("🔍 Looking for employee number option...")
-        try:
-            employee_num_btn = wait.until(EC.element_to_be_clickable((By.ID, "employeeNum")))
-            print("✅ Found employee number button")
-            wait_and_click(driver, employee_num_btn)
-            print("✅ Clicked employee number button")
-        except TimeoutException:
-            print("❌ Timeout waiting for employee number button")
-            print(f"Page source preview: {driver.page_source[:500]}...")
-            raise
-        
-        # Wait for login form
-        print("⏳ Waiting for login form elements...")
-        time.sleep(2)  # Give form time to render
-        
-        try:
-            employee_field = wait.until(EC.presence_of_element_located((By.ID, "employee-num")))
-            print("✅ Found employee-num field")
-            
-            password_field = wait.until(EC.presence_of_element_located((By.ID, "password")))
-            print("✅ Found password field")
-            
-            submit_button = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "button[type='submit']")))
-            print("✅ Found submit button")
-        except TimeoutException as e:
-            print(f"❌ Timeout waiting for form elements: {e}")
-            driver.save_screenshot("/tmp/form_timeout.png")
-            raise
-        
-        # Fill credentials
-        print("📝 Filling in credentials...")
-        employee_field.clear()
-        employee_field.send_keys(username)
-        
-        password_field.clear()
-        password_field.send_keys(password)
-        print("✅ Credentials filled")
-        
-        # Wait a bit for any client-side validation
-        time.sleep(1)
-        
-        # Check if button is still disabled
-        submit_button = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
-        is_disabled = submit_button.get_attribute("disabled")
-        print(f"🔍 Submit button disabled status: {is_disabled}")
-        
-        # Try multiple approaches to submit the form
-        print("🖱️ Attempting to submit form...")
-        
-        # Method 1: Try JavaScript click
-        try:
-            driver.execute_script("arguments[0].click();", submit_button)
-            print("✅ Submitted via JavaScript click")
-        except Exception as e1:
-            print(f"⚠️ JavaScript click failed: {e1}")
-            
-            # Method 2: Try removing disabled attribute and clicking
-            try:
-                driver.execute_script("arguments[0].removeAttribute('disabled');", submit_button)
-                time.sleep(0.5)
-                submit_button.click()
-                print("✅ Submitted after removing disabled attribute")
-            except Exception as e2:
-                print(f"⚠️ Remove disabled + click failed: {e2}")
-                
-                # Method 3: Try submitting the form directly
-                try:
-                    driver.execute_script("document.querySelector('form').submit();")
-                    print("✅ Submitted via form.submit()")
-                except Exception as e3:
-                    print(f"⚠️ Form submit failed: {e3}")
-                    
-                    # Method 4: Try pressing Enter in password field
-                    from selenium.webdriver.common.keys import Keys
-                    password_field.send_keys(Keys.RETURN)
-                    print("✅ Submitted via Enter key")
-        
-        print("⏳ Waiting for login to complete...")
-        time.sleep(5)
+        employee_num_btn = wait.until(EC.element_to_be_clickable((By.ID, "employeeNum")))
+        log.debug("✅ Found employee number button")
+        wait_and_click(driver, employee_num_btn)
+        log.debug("✅ Clicked employee number button")
+    except TimeoutException:
+        log.error("❌ Timeout waiting for employee number button")
+        capture_artifacts(driver, "employee_button_timeout")
+        raise
+    
+    # Wait for login form
+    log.debug("⏳ Waiting for login form elements...")
+    wait_for(driver, form_interactive, timeout=10)
+    
+    try:
+        employee_field = wait.until(EC.presence_of_element_located((By.ID, "employee-num")))
+        log.debug("✅ Found employee-num field")
         
-        # Check if we're still on login page
-        current_url = driver.current_url
-        print(f"📍 Current URL after login attempt: {current_url}")
+        password_field = wait.until(EC.presence_of_element_located((By.ID, "password")))
+        log.debug("✅ Found password field")
         
-        if "login" in current_url.lower():
-            print("⚠️ Still on login page, checking for error messages...")
-            driver.save_screenshot("/tmp/login_failed.png")
-            
-            # Look for error messages
+        submit_button = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "button[type='submit']")))
+        log.debug("✅ Found submit button")
+    except TimeoutException as e:
+        log.error(f"❌ Timeout waiting for form elements: {e}")
+        capture_artifacts(driver, "form_timeout")
+        raise
+    
+    # Fill credentials
+    log.debug("📝 Filling in credentials...")
+    employee_field.clear()
+    employee_field.send_keys(username)
+    
+    password_field.clear()
+    password_field.send_keys(password)
+    log.debug("✅ Credentials filled")
+    
+    # Give client-side validation a chance to enable the button
+    wait_for(driver, submit_enabled, timeout=2)
+    
+    # Check if button is still disabled
+    submit_button = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
+    is_disabled = submit_button.get_attribute("disabled")
+    log.debug(f"🔍 Submit button disabled status: {is_disabled}")
+    
+    # Try the submit methods, the one that has been working best first
+    log.debug("🖱️ Attempting to submit form...")
+    
+    def js_click():
+        driver.execute_script("arguments[0].click();", submit_button)
+    
+    def enable_and_click():
+        driver.execute_script("arguments[0].removeAttribute('disabled');", submit_button)
+        submit_button.click()
+    
+    def form_submit():
+        driver.execute_script("document.querySelector('form').submit();")
+    
+    def enter_key():
+        from selenium.webdriver.common.keys import Keys
+        password_field.send_keys(Keys.RETURN)
+    
+    submit_methods = {
+        'js_click': js_click,
+        'enable_and_click': enable_and_click,
+        'form_submit': form_submit,
+        'enter_key': enter_key,
+    }
+    
+    with span('login_submit'):
+        settle_deadline = time.time() + 20
+        for name in strategy_registry.order('submit', list(submit_methods)):
+            started = time.perf_counter()
+            settled = False
             try:
-                error_elements = driver.find_elements(By.CSS_SELECTOR, ".alert, .error, .invalid-feedback")
-                for elem in error_elements:
-                    if elem.is_displayed() and elem.text:
-                        print(f"❌ Error message found: {elem.text}")
-            except:
-                pass
-            
-            # If using test credentials, just continue
-            if username == "YOUR_EMPLOYEE_NUMBER":
-                print("⚠️ Using test credentials, skipping to test the rest of the flow...")
-                return None
+                driver.execute_script(SUBMIT_WATCH_SCRIPT)
+                submit_methods[name]()
+                log.info(f"✅ Submitted via {name}")
+                log.debug("⏳ Waiting for login to complete...")
+                # Check every couple of seconds whether the form was left
+                # sitting idle; while a request is in flight, keep waiting
+                while not settled and time.time() < settle_deadline:
+                    settled = wait_for(driver, login_settled, timeout=min(2, max(settle_deadline - time.time(), 0.1)))
+                    if not settled and login_form_idle(driver):
+                        break
+                idle = not settled and login_form_idle(driver)
+            except Exception as e:
+                log.warning(f"⚠️ Submit via {name} failed: {e}")
+                strategy_registry.record('submit', name, False, (time.perf_counter() - started) * 1000)
+                continue
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if settled:
+                strategy_registry.record('submit', name, True, elapsed_ms)
+                wait_for(driver, document_ready, timeout=10)
+                break
+            if not idle:
+                # Posting the credentials again could double-submit a login still on its way
+                log.warning(f"⚠️ Login via {name} still pending after the submit budget")
+                strategy_registry.record('submit', name, None, elapsed_ms)
+                break
+            strategy_registry.record('submit', name, False, elapsed_ms)
+    
+    # Check if we're still on login page
+    current_url = driver.current_url
+    log.debug(f"📍 Current URL after login attempt: {current_url}")
+    
+    if "login" in current_url.lower():
+        log.warning("⚠️ Still on login page, checking for error messages...")
+        capture_artifacts(driver, "login_failed")
+        
+        # Look for error messages
+        try:
+            errors = query_page(driver)['errors']
+        except Exception:
+            errors = []
+        for message in errors:
+            log.error(f"❌ Error message found: {message}")
         
-        # Navigate to earnings page
-        print(f"🧭 Navigating to earnings page: {EARNINGS_URL}")
-        driver.get(EARNINGS_URL)
-        time.sleep(3)
-        print(f"📍 Current URL: {driver.current_url}")
+        # If using test credentials, just continue
+        if username == "YOUR_EMPLOYEE_NUMBER":
+            log.warning("⚠️ Using test credentials, skipping to test the rest of the flow...")
+            return False
+        if errors:
+            raise LoginRejected(username)
+    
+    # Navigate to earnings page
+    earnings_url = current_tenant().earnings_url
+    log.debug(f"🧭 Navigating to earnings page: {earnings_url}")
+    with span('earnings_navigation'):
+        driver.get(earnings_url)
+        wait_for(driver, document_ready, timeout=10)
+    log.debug(f"📍 Current URL: {driver.current_url}")
+    
+    # Check if redirected back to login
+    if "login" in driver.current_url.lower():
+        log.error("❌ Redirected back to login page - authentication failed")
+        return False
+    
+    # Remember the authenticated session so the next run can skip this login
+    save_cached_cookies(username, driver.get_cookies())
+    return True
+
+def resume_browser_session(driver, cookies):
+    """Give the browser an HTTP session's cookies; True if that reaches the earnings page"""
+    earnings_url = current_tenant().earnings_url
+    driver.execute_cdp_cmd('Network.setCookies', {'cookies': [
+        dict({'name': c['name'], 'value': c['value'], 'path': c.get('path') or '/'},
+             **({'domain': c['domain']} if c.get('domain') else {'url': earnings_url}))
+        for c in cookies
+    ]})
+    with span('earnings_navigation'):
+        driver.get(earnings_url)
+        wait_for(driver, document_ready, timeout=10)
+    if "login" in driver.current_url.lower():
+        log.warning("⚠️ Browser did not accept the HTTP session, logging in")
+        return False
+    return True
+
+
+def selenium_login_and_download(username, password, delivered_ids=(), cookies=None):
+    """Login to Viewpoint in headless Chrome (or reuse a session's cookies) and download the latest paystub"""
+    driver = None
+    healthy = True
+    driver_manager = get_driver_manager()
+    
+    try:
+        driver = driver_manager.acquire()
         
-        # Check if redirected back to login
-        if "login" in driver.current_url.lower():
-            print("❌ Redirected back to login page - authentication failed")
+        if not (cookies and resume_browser_session(driver, cookies)) \
+                and not selenium_login(driver, username, password):
             return None
         
         # Find paystub links
-        print("⏳ Waiting for paystub links...")
-        try:
-            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "a[href*='Document/GetFile']")))
-            links = driver.find_elements(By.CSS_SELECTOR, "a[href*='Document/GetFile']")
-            print(f"✅ Found {len(links)} paystub links")
-        except TimeoutException:
-            print("❌ No paystub links found")
-            driver.save_screenshot("/tmp/no_paystubs.png")
-            # Try alternative selectors
-            print("🔍 Trying alternative selectors...")
-            links = driver.find_elements(By.CSS_SELECTOR, "a[href*='document'], a[href*='pdf'], a[href*='download']")
-            if links:
-                print(f"✅ Found {len(links)} alternative links")
+        log.debug("⏳ Waiting for paystub links...")
+        with span('link_discovery'):
+            if wait_for(driver, links_present, timeout=15):
+                links = query_page(driver)['links']
+                log.debug(f"✅ Found {len(links)} paystub links")
             else:
+                log.error("❌ No paystub links found")
+                capture_artifacts(driver, "no_paystubs")
+                # Try alternative selectors
+                log.debug("🔍 Trying alternative selectors...")
+                links = query_page(driver, FALLBACK_LINK_SELECTOR)['links']
+                if links:
+                    log.debug(f"✅ Found {len(links)} alternative links")
+            if not links:
+                log.error("❌ No paystub links found.")
                 return None
-
-        if not links:
-            print("❌ No paystub links found.")
-            return None
-
-        # ---------- вставить начало нового блока ----------
-        # Deduplicate links by their href attribute
-        unique_links = []
-        seen = set()
-        for link in links:
-            href = link.get_attribute("href")
-            if href not in seen:
-                unique_links.append(link)
-                seen.add(href)
-        # ---------- вставить конец нового блока ----------
-
         
-
-
-
-        # Get the first (latest) paystub URL
         # Get the first (most recent) paystub
-        pdf_url = unique_links[0].get_attribute("href")
-        print(f"\n📎 Selected PDF URL: {pdf_url}")
+        pdf_url = links[0]['href']
+        log.info(f"📎 Selected PDF URL: {pdf_url} ({links[0]['date'] or 'no date'})")
+        if already_delivered(pdf_url, delivered_ids):
+            return {'url': pdf_url, 'pdf': None}
         
-        # Download PDF using enhanced method
-        pdf_data = download_pdf_with_session(driver, pdf_url)
+        def via_page():
+            return download_pdf_in_page(driver, pdf_url)
         
-        if not pdf_data:
-            print("⚠️ First method failed, trying direct Selenium download...")
-            
-            # Alternative: Use Selenium to trigger download
-            original_window = driver.current_window_handle
+        def via_session():
+            return download_pdf_with_session(driver, pdf_url)
+        
+        def via_browser():
+            with span('download_browser'):
+                # Use Selenium to trigger download
+                original_window = driver.current_window_handle
             
-            # Open link in new tab
-            driver.execute_script("window.open(arguments[0], '_blank');", pdf_url)
+                # Open link in new tab
+                driver.execute_script("window.open(arguments[0], '_blank');", pdf_url)
             
-            # Switch to new tab
-            driver.switch_to.window(driver.window_handles[-1])
-            time.sleep(5)
+                # Switch to new tab
+                driver.switch_to.window(driver.window_handles[-1])
+                wait_for(driver, document_ready, timeout=5)
+                is_pdf_tab = "application/pdf" in driver.execute_script("return document.contentType || '';")
             
-            # Check if PDF is displayed
-            if "application/pdf" in driver.execute_script("return document.contentType || '';"):
-                print("✅ PDF opened in browser")
-                
-                # Try to get PDF content from browser
-                # This is tricky as PDFs are handled by browser plugins
-                # We'll need to use the download approach
-                
                 # Close tab and switch back
                 driver.close()
                 driver.switch_to.window(original_window)
+                if not is_pdf_tab:
+                    return None
                 
-                # Use alternative download method
-                print("📥 Attempting alternative download...")
-                
-                # Click the link to trigger browser download
-                unique_links[0].click()
-                time.sleep(5)
-                
-                # Check for downloaded file in /tmp
-                import glob
-                pdf_files = glob.glob("/tmp/*.pdf")
-                if pdf_files:
-                    newest_pdf = max(pdf_files, key=os.path.getctime)
-                    with open(newest_pdf, 'rb') as f:
-                        pdf_data = f.read()
-                    print(f"✅ Found downloaded PDF: {newest_pdf}, size: {len(pdf_data)} bytes")
-                    
-                    # Clean up
-                    os.remove(newest_pdf)
-            else:
-                # Close tab and switch back
-                driver.close()
-                driver.switch_to.window(original_window)
+                # PDFs are handled by the browser viewer, so click the link
+                # to trigger a browser download instead
+                log.info("✅ PDF opened in browser")
+                log.debug("📥 Attempting alternative download...")
+                clicked_at = time.time()
+                driver.execute_script("""
+                    var href = arguments[0];
+                    var link = Array.prototype.find.call(document.querySelectorAll('a'),
+                        function (a) { return a.href === href; });
+                    if (link) link.click();
+                """, pdf_url)
+                wait_for(driver, pdf_downloaded(clicked_at), timeout=5)
+            
+                # Check for the downloaded file
+                pdf_files = glob.glob(os.path.join(workspace_dir('downloads'), '*.pdf'))
+                if not pdf_files:
+                    return None
+                newest_pdf = max(pdf_files, key=os.path.getctime)
+                with open(newest_pdf, 'rb') as f:
+                    pdf_data = f.read()
+                log.info(f"✅ Found downloaded PDF: {newest_pdf}, size: {len(pdf_data)} bytes")
+                os.remove(newest_pdf)
+                return pdf_data
+        
+        def via_fresh_cookies():
+            # A fresh cookie copy with the current page as referer
+            with span('download_final_retry'):
+                session = session_from_cookies(driver.get_cookies())
+                return fetch_pdf(session, pdf_url, referer=driver.current_url).data
         
+        def is_pdf(pdf_data):
+            if pdf_data and not pdf_data.startswith(b'%PDF'):
+                log.warning(f"⚠️ Downloaded data is not a valid PDF (starts with: {pdf_data[:20]})")
+                # Save what we got for debugging
+                with open(artifact_path("downloaded_content.html"), 'wb') as f:
+                    f.write(pdf_data)
+                log.debug(f"📄 Saved downloaded content to {artifact_path('downloaded_content.html')} for debugging")
+                return False
+            return bool(pdf_data)
+        
+        # Try the download methods, the one that has been working best first
+        pdf_data = strategy_registry.run('download', [
+            ('in_page', via_page),
+            ('session', via_session),
+            ('browser', via_browser),
+            ('fresh_cookies', via_fresh_cookies),
+        ], accept=is_pdf)
         if not pdf_data:
-            print("❌ All download methods failed")
+            log.error("❌ All download methods failed")
             return None
         
-        # Verify we have valid PDF data
-        if not pdf_data.startswith(b'%PDF'):
-            print(f"⚠️ Downloaded data is not a valid PDF (starts with: {pdf_data[:20]})")
-            
-            # Save what we got for debugging
-            with open("/tmp/downloaded_content.html", 'wb') as f:
-                f.write(pdf_data)
-            print("📄 Saved downloaded content to /tmp/downloaded_content.html for debugging")
-            
-            # Try one more time with a simple GET request using all cookies
-            print("🔄 Final attempt with simple requests...")
-            import requests
-            
-            session = requests.Session()
-            for cookie in driver.get_cookies():
-                session.cookies.set(cookie['name'], cookie['value'])
-            
-            # Add referer header
-            session.headers['Referer'] = driver.current_url
-            
-            response = session.get(pdf_url, stream=True)
-            if response.status_code == 200:
-                pdf_data = response.content
-                if pdf_data.startswith(b'%PDF'):
-                    print("✅ Final attempt successful!")
-                else:
-                    print("❌ Final attempt also returned non-PDF content")
-                    return None
-        
-        return pdf_data
+        return {'url': pdf_url, 'pdf': pdf_data}
         
-    except Exception as e:
-        print(f"❌ Error during login or download: {str(e)}")
-        print(f"Full traceback: {traceback.format_exc()}")
+    except LoginRejected:
+        raise
+    except Exception:
+        log.exception("❌ Error during login or download")
+        if driver and not capture_artifacts(driver, "error_screenshot"):
+            healthy = False
+        return None
+    finally:
         if driver:
-            try:
-                driver.save_screenshot("/tmp/error_screenshot.png")
-                print("📸 Error screenshot saved")
-            except:
-                pass
+            driver_manager.release(healthy)
+
+def selenium_login_session(username, password):
+    """Log in with the browser and hand its cookies to a pooled HTTP session"""
+    driver = None
+    healthy = True
+    driver_manager = get_driver_manager()
+    try:
+        driver = driver_manager.acquire()
+        if not selenium_login(driver, username, password):
+            return None
+        session = session_from_cookies(driver.get_cookies())
+        response = session.get(current_tenant().earnings_url, allow_redirects=True, timeout=30)
+        if "login" in response.url.lower():
+            return None
+        return session, response
+    except LoginRejected:
+        raise
+    except Exception as e:
+        log.error(f"❌ Error during browser login: {e}")
+        if driver and not capture_artifacts(driver, "error_screenshot"):
+            healthy = False
         return None
     finally:
         if driver:
+            driver_manager.release(healthy)
+
+def open_authenticated_session(username, password):
+    """Return (session, earnings response) from the cheapest login that works; raises LoginRejected"""
+    opened = cached_session(username)
+    if not opened and LOGIN_ENGINE in ('auto', 'http'):
+        opened = http_login(username, password)
+    if not opened and LOGIN_ENGINE != 'http':
+        opened = selenium_login_session(username, password)
+    return opened
+
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = os.environ.get('SMTP_PORT')
+SMTP_SSL = os.environ.get('SMTP_SSL', '1') == '1'
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+SMTP_RETRIES = int(os.environ.get('SMTP_RETRIES', '2'))
+
+# One authenticated SMTP connection per sender account, shared by every user it mails for
+smtp_senders = {}
+smtp_senders_lock = threading.Lock()
+
+
+def get_smtp_sender(email_from, email_pass):
+    """Return the pooled yagmail client and send lock for a sender account"""
+    yagmail = lazy_import('yagmail')
+    with smtp_senders_lock:
+        sender = smtp_senders.get(email_from)
+        if sender is not None and sender['password'] != email_pass:
+            # The password changed: log the old client out instead of leaking its connection
+            close_smtp_sender(sender)
+            sender = None
+        if sender is None:
+            sender = {
+                'yag': yagmail.SMTP(email_from, email_pass, host=SMTP_HOST, port=SMTP_PORT,
+                                    smtp_ssl=SMTP_SSL, smtp_starttls=None if SMTP_STARTTLS else False),
+                'password': email_pass,
+                'connected': False,
+                'lock': threading.Lock(),
+            }
+            smtp_senders[email_from] = sender
+        return sender
+
+
+def is_transient_smtp_error(error):
+    """Dropped connections, network errors and 4xx replies are worth a reconnect"""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    # SMTPException subclasses OSError, so only plain network errors count here
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def close_smtp_sender(sender):
+    """Log out of a pooled SMTP connection once no message is being sent on it"""
+    with sender['lock']:
+        if sender['connected']:
             try:
-                driver.quit()
-                print("🔚 Chrome driver closed")
-            except:
-                pass
+                sender['yag'].close()
+            except Exception as e:
+                log.warning(f"⚠️ Failed to close SMTP connection: {e}")
+            sender['connected'] = False
 
+
+def close_smtp_connections():
+    """Log out of every pooled SMTP connection at the end of an invocation"""
+    with smtp_senders_lock:
+        for sender in smtp_senders.values():
+            close_smtp_sender(sender)
+
+
+@timed('send_email')
 def send_email(email_to, email_from, email_pass, pdf_data, username):
     """Send email with paystub attachment"""
     try:
-        # Save PDF temporarily
-        temp_file = f"/tmp/paystub_{username}_{int(time.time())}.pdf"
-        with open(temp_file, 'wb') as f:
-            f.write(pdf_data)
-        
-        # Send email
-        yag = yagmail.SMTP(email_from, email_pass)
-        yag.send(
-            to=email_to,
-            subject="🧾 Weekly Paystub",
-            contents="Here is your newest paystub.",
-            attachments=temp_file
-        )
-        print(f"✅ Email sent to {email_to}")
-        
-        # Clean up
-        os.remove(temp_file)
-        return True
-        
+        sender = get_smtp_sender(email_from, email_pass)
     except Exception as e:
-        print(f"❌ Failed to send email: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+        log.error(f"❌ Failed to set up email sender: {e}")
         return False
+    filename = f"paystub_{username}_{int(time.time())}.pdf"
+    
+    for attempt in range(SMTP_RETRIES + 1):
+        try:
+            # Attach straight from memory; yagmail takes the file name from .name
+            attachment = io.BytesIO(pdf_data)
+            attachment.name = filename
+            
+            with sender['lock']:
+                yag = sender['yag']
+                recipients, message = yag.prepare_send(
+                    to=email_to,
+                    subject="🧾 Weekly Paystub",
+                    contents="Here is your newest paystub.",
+                    attachments=attachment
+                )
+                if not sender['connected']:
+                    yag.login()
+                    sender['connected'] = True
+                yag.smtp.sendmail(yag.user, recipients, message)
+            log.info(f"✅ Email sent to {email_to}")
+            return True
+            
+        except Exception as e:
+            with sender['lock']:
+                if sender['connected']:
+                    sender['yag'].close()
+                    sender['connected'] = False
+            if attempt < SMTP_RETRIES and is_transient_smtp_error(e):
+                log.warning(f"⚠️ Transient SMTP error, reconnecting: {e}")
+                time.sleep(attempt + 1)
+                continue
+            log.exception("❌ Failed to send email")
+            return False
+
+def archive_prefix(username):
+    """S3 prefix of a user's archived paystubs; other tenants' users are kept under their host"""
+    tenant = current_tenant()
+    if tenant.origin != DEFAULT_TENANT.origin:
+        return f"paystubs/{tenant.host}/{username}/"
+    return f"paystubs/{username}/"
 
-def save_to_s3(pdf_data, username, bucket_name=None):
-    """Optionally save paystub to S3 for archival"""
+
+@timed('save_to_s3')
+def save_to_s3(pdf_data, username, bucket_name=None, document=None, digest=None):
+    """Optionally save paystub to S3 for archival; returns True once the object is stored.
+    
+    With a document ID the key is stable, so an object whose stored
+    sha256 matches is left alone instead of being uploaded again.
+    """
     if not bucket_name:
-        return
+        return False
     
     try:
-        s3 = boto3.client('s3', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
-        key = f"paystubs/{username}/{username}_{int(time.time())}.pdf"
+        s3 = aws_client('s3')
+        if document:
+            key = f"{archive_prefix(username)}{document}.pdf"
+        else:
+            key = f"{archive_prefix(username)}{username}_{int(time.time())}.pdf"
+        digest = digest or hashlib.sha256(pdf_data).hexdigest()
+        
+        if document:
+            try:
+                existing = s3.head_object(Bucket=bucket_name, Key=key)
+                if existing.get('Metadata', {}).get('sha256') == digest:
+                    log.info(f"📦 Already archived: s3://{bucket_name}/{key}")
+                    return True
+            except Exception:
+                pass  # not archived yet
+        
         s3.put_object(
             Bucket=bucket_name,
             Key=key,
             Body=pdf_data,
-            ContentType='application/pdf'
+            ContentType='application/pdf',
+            Metadata={'sha256': digest}
         )
-        print(f"📦 Saved to S3: s3://{bucket_name}/{key}")
+        log.info(f"📦 Saved to S3: s3://{bucket_name}/{key}")
+        return True
     except Exception as e:
-        print(f"❌ Failed to save to S3: {e}")
+        log.error(f"❌ Failed to save to S3: {e}")
+        return False
+
+DELIVERY_WORKERS = int(os.environ.get('DELIVERY_WORKERS', '4'))
+
+# Archive and notify sinks run here so browser work for the next user can start
+delivery_pool = None
+delivery_pool_lock = threading.Lock()
+
+
+def get_delivery_pool():
+    """Return the shared delivery thread pool, creating it on first use"""
+    global delivery_pool
+    with delivery_pool_lock:
+        if delivery_pool is None:
+            delivery_pool = ThreadPoolExecutor(max_workers=DELIVERY_WORKERS, thread_name_prefix='delivery')
+        return delivery_pool
+
+
+def run_sink(user_config, func, *args):
+    """Run a delivery sink on a pool thread under the user's log context, returning (result, timings)"""
+    worker_state.timings = {}
+    worker_state.debug = bool(user_config.get('debug'))
+    log.begin(secrets=(user_config.get('password'), user_config.get('email_pass')),
+              user=user_config.get('username'), sink=func.__name__)
+    try:
+        with tenant_context(tenant_for(user_config)):
+            return func(*args), worker_state.timings
+    finally:
+        log.end()
+        worker_state.timings = None
+        worker_state.debug = False
+
+
+def start_delivery(user_config, index, paystub, digest):
+    """Start archiving and emailing a paystub concurrently from the same bytes"""
+    username = user_config['username']
+    pool = get_delivery_pool()
+    pending = {
+        'user_config': user_config,
+        'index': index,
+        'url': paystub['url'],
+        'digest': digest,
+        'email': pool.submit(run_sink, user_config, send_email, user_config['email_to'],
+                             user_config['email_from'], user_config['email_pass'], paystub['pdf'], username),
+    }
+    if user_config.get('s3_bucket'):
+        pending['archive'] = pool.submit(run_sink, user_config, save_to_s3, paystub['pdf'], username,
+                                         user_config['s3_bucket'], document_id(paystub['url']), digest)
+    return pending
+
+
+def finish_delivery(pending):
+    """Wait for a user's sinks and return (result fields, sink timings)"""
+    timings = {}
+    if 'archive' in pending:
+        timings.update(pending['archive'].result()[1])
+    sent, email_timings = pending['email'].result()
+    timings.update(email_timings)
+    
+    user_config = pending['user_config']
+    if not sent:
+        if user_config.get('email_pass_param'):
+            secret_resolver.invalidate(user_config['email_pass_param'])
+        return {'success': False, 'status': 'email_failed'}, timings
+    with tenant_context(tenant_for(user_config)):
+        record_delivery(user_config['username'], pending['index'], pending['url'], pending['digest'])
+    return {'success': True, 'status': 'delivered'}, timings
 
 def process_user(user_config):
     """Process a single user's paystub download and email"""
@@ -507,115 +2488,752 @@ def process_user(user_config):
     email_to = user_config.get('email_to')
     email_from = user_config.get('email_from')
     email_pass = user_config.get('email_pass')
-    s3_bucket = user_config.get('s3_bucket')
     
     # Validate config
     if not all([username, password, email_to, email_from, email_pass]):
-        print(f"⚠️ Missing required configuration for user")
+        log.warning(f"⚠️ Missing required configuration for user")
         missing = []
         if not username: missing.append("username")
         if not password: missing.append("password")
         if not email_to: missing.append("email_to")
         if not email_from: missing.append("email_from")
         if not email_pass: missing.append("email_pass")
-        print(f"Missing fields: {', '.join(missing)}")
-        return False
+        log.warning("⚠️ Missing fields", missing=missing)
+        return {'success': False, 'status': 'invalid_config'}
     
-    # Download paystub
-    pdf_data = login_and_download(username, password)
-    if not pdf_data:
-        return False
+    # Download paystub unless the newest one was already delivered
+    index = load_delivered_index(username)
+    try:
+        paystub = login_and_download(username, password, set(index.get('documents', {})))
+    except LoginRejected:
+        # The password may have been rotated; re-read it next time
+        if user_config.get('password_param'):
+            secret_resolver.invalidate(user_config['password_param'])
+        return {'success': False, 'status': 'login_rejected'}
+    if not paystub:
+        return {'success': False, 'status': 'download_failed'}
+    if paystub['pdf'] is None:
+        return {'success': True, 'status': 'no_new_paystub'}
     
-    # Save to S3 if configured
-    if s3_bucket:
-        save_to_s3(pdf_data, username, s3_bucket)
+    pdf_data = paystub['pdf']
+    digest = paystub.get('sha256') or hashlib.sha256(pdf_data).hexdigest()
+    if any(doc.get('sha256') == digest for doc in index.get('documents', {}).values()):
+        log.info("📭 Identical paystub content was already delivered")
+        # Remember this document ID too, so the next run skips it before downloading
+        record_delivery(username, index, paystub['url'], digest)
+        return {'success': True, 'status': 'no_new_paystub'}
     
-    # Send email
-    return send_email(email_to, email_from, email_pass, pdf_data, username)
+    # Archive to S3 (if configured) and send the email in the background
+    return {'pending': start_delivery(user_config, index, paystub, digest)}
 
-def lambda_handler(event, context):
-    """Lambda handler function"""
-    print("🚀 Starting paystub download process...")
-    print(f"Environment: AWS_REGION={os.environ.get('AWS_REGION')}")
-    print(f"Event: {json.dumps(event, indent=2)}")
+BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', '8'))
+BACKFILL_MAX_PAGES = int(os.environ.get('BACKFILL_MAX_PAGES', '50'))
+
+
+def collect_paystub_links(session, response):
+    """Walk the paginated earnings history and return every paystub link, newest first"""
+    links = []
+    seen_pages = {response.url}
+    for _ in range(BACKFILL_MAX_PAGES):
+        for url in find_paystub_links(response.text, response.url):
+            if url not in links:
+                links.append(url)
+        next_url = find_next_page(response.text, response.url)
+        if not next_url or next_url in seen_pages:
+            break
+        seen_pages.add(next_url)
+        response = session.get(next_url, allow_redirects=True, timeout=30)
+        if response.status_code != 200:
+            log.warning(f"⚠️ History page returned HTTP {response.status_code}: {next_url}")
+            break
+    return links
+
+
+def collect_paystub_links_in_browser(username, password, session):
+    """Walk the earnings history in Chrome, for pages whose links are rendered by script.
+    
+    Chrome starts from the session's cookies (logging in only if they are
+    not accepted). Returns every paystub link, newest first, or None if
+    the browser could not reach the earnings page.
+    """
+    driver = None
+    healthy = True
+    driver_manager = get_driver_manager()
+    try:
+        driver = driver_manager.acquire()
+        if not resume_browser_session(driver, cookies_from_session(session)) \
+                and not selenium_login(driver, username, password):
+            return None
+        links = []
+        seen_pages = {driver.current_url}
+        for _ in range(BACKFILL_MAX_PAGES):
+            wait_for(driver, links_present, timeout=15)
+            for link in query_page(driver)['links']:
+                if link['href'] not in links:
+                    links.append(link['href'])
+            next_url = driver.execute_script("var a = document.querySelector('a[rel~=\"next\"]'); "
+                                             "return a ? a.href : null;")
+            if not next_url or next_url in seen_pages:
+                break
+            seen_pages.add(next_url)
+            driver.get(next_url)
+            wait_for(driver, document_ready, timeout=10)
+        return links
+    except LoginRejected:
+        raise
+    except Exception as e:
+        log.error(f"❌ Error walking the earnings history in the browser: {e}")
+        if driver and not capture_artifacts(driver, "error_screenshot"):
+            healthy = False
+        return None
+    finally:
+        if driver:
+            driver_manager.release(healthy)
+
+
+def archived_document_ids(bucket_name, username):
+    """Return the document IDs already archived under a user's S3 prefix"""
+    prefix = archive_prefix(username)
+    documents = set()
+    paginator = aws_client('s3').get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for item in page.get('Contents', []):
+            name = item['Key'][len(prefix):]
+            if name.endswith('.pdf'):
+                documents.add(name[:-len('.pdf')])
+    return documents
+
+
+def backfill_user(user_config):
+    """Archive every historical paystub missing from S3, reusing one login session"""
+    username = user_config.get('username')
+    password = user_config.get('password')
+    bucket_name = user_config.get('s3_bucket')
+    if not all([username, password, bucket_name]):
+        log.warning("⚠️ Backfill needs username, password and s3_bucket")
+        return {'success': False, 'status': 'invalid_config'}
     
-    # Test Chrome installation
     try:
-        chrome_version = os.popen('/opt/chrome/chrome --version').read().strip()
-        print(f"Chrome version: {chrome_version}")
-    except:
-        print("❌ Could not get Chrome version")
+        with span('backfill_login'):
+            opened = open_authenticated_session(username, password)
+    except LoginRejected:
+        if user_config.get('password_param'):
+            secret_resolver.invalidate(user_config['password_param'])
+        return {'success': False, 'status': 'login_rejected'}
+    if not opened:
+        return {'success': False, 'status': 'login_failed'}
+    session, response = opened
+    
+    with span('backfill_discovery'):
+        links = collect_paystub_links(session, response)
+        if not links and LOGIN_ENGINE != 'http':
+            log.info("↩️ No static paystub links, walking the history in the browser")
+            try:
+                links = collect_paystub_links_in_browser(username, password, session) or []
+            except LoginRejected:
+                if user_config.get('password_param'):
+                    secret_resolver.invalidate(user_config['password_param'])
+                return {'success': False, 'status': 'login_rejected'}
+        if not links:
+            # An empty history is not a successful sync
+            log.error("❌ No paystub links found in the earnings history")
+            return {'success': False, 'status': 'no_paystubs_found'}
+        archived = archived_document_ids(bucket_name, username)
+    missing = [url for url in links if document_id(url) not in archived]
+    log.info(f"🗄️ {len(links)} paystubs in history, {len(missing)} not yet archived")
+    
+    tenant = current_tenant()
+    
+    def archive(pdf_url):
+        pdf = fetch_pdf(session, pdf_url, referer=response.url)
+        if not pdf.data:
+            return False
+        with tenant_context(tenant):
+            return save_to_s3(pdf.data, username, bucket_name, document_id(pdf_url), pdf.sha256)
+    
+    # The session's pooled adapter keeps these on a handful of warm connections
+    with span('backfill_download'):
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(1, min(BACKFILL_WORKERS, len(missing))),
+                                    thread_name_prefix='backfill') as pool:
+                archived_ok = list(pool.map(archive, missing))
+        else:
+            archived_ok = []
+    failed = [url for url, ok in zip(missing, archived_ok) if not ok]
+    return {
+        'success': not failed,
+        'status': 'backfilled',
+        'documents': len(links),
+        'archived': len(missing) - len(failed),
+        'failed': failed,
+    }
+
+def run_user(index, total, user_config, action=process_user):
+    """Resolve secrets and run one user through an action, returning its result entry"""
+    worker_state.timings = {}
+    worker_state.debug = bool(user_config.get('debug'))
+    worker_state.tenant = tenant = tenant_for(user_config)
+    # The user's lines are written together when the user finishes
+    log.begin(secrets=(user_config.get('password'), user_config.get('email_pass')),
+              user=user_config.get('username'), slot=getattr(worker_state, 'slot', 0), host=tenant.host)
+    log.info("👤 Processing user", index=index + 1, total=total)
+    worker_state.resources = resource_monitor.start_user() if RESOURCE_SAMPLING else None
+    slot = getattr(worker_state, 'slot', 0)
+    mark_slot_busy(slot, True)
+    started = time.perf_counter()
+    result = {'username': user_config.get('username', 'unknown'), 'host': tenant.host}
+    try:
+        # Never let a previous user's downloads or artifacts be picked up
+        clear_slot_scratch()
+        
+        # If passwords are stored in SSM, retrieve them
+        with span('resolve_secrets'):
+            if 'password_param' in user_config:
+                user_config['password'] = get_parameter(user_config['password_param'])
+            if 'email_pass_param' in user_config:
+                user_config['email_pass'] = get_parameter(user_config['email_pass_param'])
+        log.add_secrets(user_config.get('password'), user_config.get('email_pass'))
+        
+        result.update(action(user_config))
+    except Exception as e:
+        log.exception("❌ Error processing user")
+        result.update({
+            'success': False,
+            'status': 'error',
+            'error': str(e)
+        })
+    finally:
+        # Failure artifacts stay until the slot's next user (or quota eviction)
+        clear_slot_scratch(keep_artifacts=debug_enabled() or not result.get('success', False))
+        mark_slot_busy(slot, False)
+        enforce_workspace_quota()
+    
+    result['timings'] = worker_state.timings
+    result['timings']['total'] = (time.perf_counter() - started) * 1000
+    worker_state.timings = None
+    if worker_state.resources is not None:
+        result['resources'] = resource_monitor.stop_user(worker_state.resources)
+        worker_state.resources = None
+    worker_state.tenant = None
+    log.end()
+    return result
+
+def finish_user(result):
+    """Fold a user's background deliveries into its result and emit its metrics"""
+    pending = result.pop('pending', None)
+    timings = result['timings']
+    if pending:
+        waited = time.perf_counter()
+        fields, sink_timings = finish_delivery(pending)
+        result.update(fields)
+        timings.update(sink_timings)
+        timings['delivery_wait'] = (time.perf_counter() - waited) * 1000
+    user_costs.observe(result['username'], timings['total'])
+    log.info("🏁 User finished", user=result['username'], status=result.get('status'),
+             total_ms=round(timings['total'], 1))
+    emit_metrics('user', timings, {'username': result['username'], 'success': result['success']},
+                 result.get('resources', {}).get('peak'))
+    result['timings'] = {name: round(ms, 1) for name, ms in timings.items()}
+    return result
+
+DEADLINE_RESERVE_MS = int(os.environ.get('DEADLINE_RESERVE_MS', '20000'))
+USER_COST_ESTIMATE_MS = float(os.environ.get('USER_COST_ESTIMATE_MS', '60000'))
+
+
+class UserCostModel:
+    """Recent per-user processing time (EWMA), with an overall average for users not seen yet"""
+    ALPHA = 0.3
+
+    def __init__(self, default_ms=USER_COST_ESTIMATE_MS):
+        self.default_ms = default_ms
+        self.lock = threading.Lock()
+        self.costs = {}
+
+    def estimate(self, username):
+        with self.lock:
+            return self.costs.get(username, self.costs.get('*', self.default_ms))
+
+    def observe(self, username, elapsed_ms):
+        with self.lock:
+            for key in (username, '*'):
+                previous = self.costs.get(key)
+                self.costs[key] = elapsed_ms if previous is None else \
+                    (1 - self.ALPHA) * previous + self.ALPHA * elapsed_ms
+
+    def export(self):
+        with self.lock:
+            return dict(self.costs)
+
+    def merge(self, costs):
+        """Adopt estimates carried over from an earlier invocation, keeping our own"""
+        with self.lock:
+            for key, value in (costs or {}).items():
+                self.costs.setdefault(key, value)
+
+
+user_costs = UserCostModel()
+
+
+class Deadline:
+    """Decides whether a user can still be finished before the invocation times out.
+    
+    A worker also gets limit_ms, the time its dispatcher had left, so it
+    stops starting users the dispatcher would no longer wait for.
+    """
+
+    def __init__(self, context=None, reserve_ms=DEADLINE_RESERVE_MS, limit_ms=None):
+        self.context = context
+        self.reserve_ms = reserve_ms
+        self.limit_ends = time.monotonic() + limit_ms / 1000 if limit_ms is not None else None
+
+    def remaining_ms(self):
+        remaining = []
+        if self.context is not None:
+            remaining.append(self.context.get_remaining_time_in_millis() - self.reserve_ms)
+        if self.limit_ends is not None:
+            remaining.append((self.limit_ends - time.monotonic()) * 1000)
+        return min(remaining) if remaining else float('inf')
+
+    def allows(self, user_config):
+        remaining = self.remaining_ms()
+        needed = user_costs.estimate(user_config.get('username'))
+        if remaining >= needed:
+            return True
+        log.info(f"⏳ {remaining / 1000:.0f}s left, {user_config.get('username')} needs about "
+                 f"{needed / 1000:.0f}s; deferring the remaining users")
+        return False
+
+
+def deferred_result(user_config):
+    return {'username': user_config.get('username'), 'host': tenant_for(user_config).host,
+            'success': False, 'status': 'deferred'}
+
+
+def process_users(users, action=process_user, deadline=None):
+    """Run every user through a bounded worker pool, keeping results in input order.
+    
+    Users are started grouped by Viewpoint host, and a worker keeps to
+    the host it served last so its browser and connections stay warm for
+    that tenant. At most TENANT_MAX_CONCURRENCY users of one host run at
+    once (0 means no limit beyond MAX_CONCURRENCY).
+    
+    With a deadline, users are started only while the expected cost
+    still fits; the first one that does not fit and every user not yet
+    started come back as "deferred" so a later run can resume there.
+    The first user always starts, so one whose estimate exceeds a whole
+    invocation still gets tried instead of being deferred forever.
+    """
+    total = len(users)
+    concurrency = max(1, min(MAX_CONCURRENCY, total))
+    results = [None] * total
+    hosts = [tenant_for(u).host for u in users]
+    pending = tenant_groups(users)
+    running = {}
+    claim_lock = threading.Condition()
+    cursor = {'stopped': False, 'claimed': False}
+    
+    def has_room(index):
+        return not TENANT_MAX_CONCURRENCY or running.get(hosts[index], 0) < TENANT_MAX_CONCURRENCY
+    
+    def claim(last_host):
+        with claim_lock:
+            while True:
+                if cursor['stopped'] or not pending:
+                    return None
+                index = next((i for i in pending if hosts[i] == last_host and has_room(i)), None)
+                if index is None:
+                    index = next((i for i in pending if has_room(i)), None)
+                if index is not None:
+                    break
+                # Every remaining user's tenant is at its limit; wait for one to finish
+                claim_lock.wait()
+            if deadline is not None and cursor['claimed'] and not deadline.allows(users[index]):
+                cursor['stopped'] = True
+                claim_lock.notify_all()
+                return None
+            cursor['claimed'] = True
+            pending.remove(index)
+            running[hosts[index]] = running.get(hosts[index], 0) + 1
+            return index
+    
+    def release(index):
+        with claim_lock:
+            running[hosts[index]] -= 1
+            claim_lock.notify_all()
+    
+    def work():
+        index = claim(None)
+        while index is not None:
+            try:
+                results[index] = run_user(index, total, users[index], action)
+            finally:
+                release(index)
+            index = claim(hosts[index])
+    
+    if concurrency == 1:
+        work()
+    else:
+        log.info(f"🧵 Processing {total} users on {len(set(hosts))} hosts with {concurrency} workers")
+        slots = queue.Queue()
+        for slot in range(concurrency):
+            slots.put(slot)
+        with ThreadPoolExecutor(max_workers=concurrency,
+                                initializer=assign_worker_slot,
+                                initargs=(slots,)) as pool:
+            for future in [pool.submit(work) for _ in range(concurrency)]:
+                future.result()
+    
+    # Deliveries overlap with later users' downloads; wait for the rest now
+    return [finish_user(result) if result else deferred_result(user_config)
+            for result, user_config in zip(results, users)]
+
+SHARD_SIZE = int(os.environ.get('SHARD_SIZE', '1'))
+FANOUT_MAX_PARALLEL = int(os.environ.get('FANOUT_MAX_PARALLEL', '50'))
+INVOKE_BACKEND = os.environ.get('INVOKE_BACKEND', 'lambda')
+
+
+def invoke_lambda(payload):
+    """Invoke this function synchronously with a payload and return its response"""
+    response = aws_client('lambda').invoke(
+        FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'],
+        InvocationType='RequestResponse',
+        Payload=json.dumps(payload).encode('utf-8')
+    )
+    if response.get('FunctionError'):
+        raise RuntimeError(f"Worker failed: {response['Payload'].read().decode('utf-8', 'replace')[:500]}")
+    return json.loads(response['Payload'].read())
+
+
+def invoke_lambda_async(payload):
+    """Queue an asynchronous invocation of this function and return immediately"""
+    response = aws_client('lambda').invoke(
+        FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'],
+        InvocationType='Event',
+        Payload=json.dumps(payload).encode('utf-8')
+    )
+    return {'statusCode': response.get('StatusCode')}
+
+
+local_shard_lock = threading.Lock()
+
+
+def invoke_local(payload):
+    """Run a shard (or a continuation) in-process, for local runs and tests.
+    
+    A worker shard runs only the worker path: lambda_handler's per-invocation
+    setup and teardown (log run context, resource peaks, pooled SMTP
+    connections) belong to the dispatching invocation in this process.
+    Shards run one at a time since they share this process's browser slots.
+    """
+    if payload.get('mode') != 'worker':
+        return lambda_handler(payload, None)
+    # Built before queueing for the lock, which also counts against the dispatcher's time
+    deadline = Deadline(limit_ms=payload['deadline_ms']) if payload.get('deadline_ms') is not None else None
+    with local_shard_lock:
+        users = select_users([dict(user_config) for user_config in USERS], payload.get('users') or [])
+        prefetch_user_secrets(users)
+        results = process_users(users, deadline=deadline)
+    return {'statusCode': 200, 'body': json.dumps({'message': 'Paystub shard complete', 'results': results})}
+
+
+# Pluggable so dispatching and continuations can be exercised without AWS
+INVOKE_BACKENDS = {
+    'lambda': invoke_lambda,
+    'lambda_async': invoke_lambda_async,
+    'local': invoke_local,
+}
+
+
+def shard_users(users, shard_size):
+    """Split users into shards of user keys, keeping each tenant's users together"""
+    keys = [user_key(users[i].get('username'), tenant_for(users[i]).host) for i in tenant_groups(users)]
+    return [keys[i:i + shard_size] for i in range(0, len(keys), shard_size)]
+
+
+def invoke_shard(shard, deadline=None):
+    """Send one shard to a worker invocation and return its per-user results.
     
+    With a deadline the worker is told how long the dispatcher has left,
+    and a shard that would start after that time is deferred instead.
+    """
+    payload = {'mode': 'worker', 'users': shard}
+    if deadline is not None:
+        remaining = deadline.remaining_ms()
+        if remaining <= 0:
+            log.info(f"⏳ No time left to start shard {shard}; deferring it")
+            return [dict(split_user_key(key), success=False, status='deferred') for key in shard]
+        if remaining != float('inf'):
+            payload['deadline_ms'] = int(remaining)
     try:
-        chromedriver_version = os.popen('/opt/chromedriver --version').read().strip()
-        print(f"ChromeDriver version: {chromedriver_version}")
-    except:
-        print("❌ Could not get ChromeDriver version")
+        response = INVOKE_BACKENDS[INVOKE_BACKEND](payload)
+        body = response['body']
+        return json.loads(body)['results'] if isinstance(body, str) else body['results']
+    except Exception as e:
+        log.error(f"❌ Shard {shard} failed: {e}")
+        return [dict(split_user_key(key), success=False, status='error', error=str(e)) for key in shard]
+
+
+def dispatch_users(users, shard_size, deadline=None):
+    """Fan users out to parallel worker invocations and aggregate their results in input order"""
+    shards = shard_users(users, max(1, shard_size))
+    log.info(f"📤 Dispatching {len(users)} users in {len(shards)} shards via {INVOKE_BACKEND}")
+    with ThreadPoolExecutor(max_workers=max(1, min(FANOUT_MAX_PARALLEL, len(shards)))) as pool:
+        shard_results = list(pool.map(lambda shard: invoke_shard(shard, deadline), shards))
     
+    by_key = {}
+    for results in shard_results:
+        for result in results:
+            by_key[user_key(result.get('username'), result.get('host', DEFAULT_TENANT.host))] = result
+    return [by_key.get(user_key(u.get('username'), tenant_for(u).host), {
+        'username': u.get('username'),
+        'success': False,
+        'status': 'error',
+        'error': 'No result from worker',
+    }) for u in users]
 
 
+CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', '/tmp/checkpoints')
+CHECKPOINT_BUCKET = os.environ.get('CHECKPOINT_BUCKET')
+CONTINUATION_BACKEND = os.environ.get('CONTINUATION_BACKEND', 'lambda_async')
+MAX_CONTINUATIONS = int(os.environ.get('MAX_CONTINUATIONS', '10'))
 
 
+def save_checkpoint(run_id, checkpoint):
+    """Persist a run's finished results and pending users to /tmp and, if configured, S3"""
+    body = json.dumps(checkpoint)
+    try:
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        with open(os.path.join(CHECKPOINT_DIR, f"{run_id}.json"), 'w') as f:
+            f.write(body)
+    except Exception as e:
+        log.warning(f"⚠️ Failed to write checkpoint locally: {e}")
+    if CHECKPOINT_BUCKET:
+        aws_client('s3').put_object(Bucket=CHECKPOINT_BUCKET, Key=f"checkpoints/{run_id}.json",
+                                    Body=body.encode('utf-8'), ContentType='application/json')
+    log.info(f"💾 Checkpointed run {run_id}: {len(checkpoint['pending'])} users pending")
 
-    # Get users configuration from event or SSM Parameter Store
-    users = []
 
+def load_checkpoint(run_id):
+    """Load a run's checkpoint from /tmp, falling back to S3; None if it is gone"""
     try:
-        users_json = os.environ.get("USERS_JSON", "[]")
-        users = json.loads(users_json)
-        print(f"📋 Loaded {len(users)} users from environment")
+        with open(os.path.join(CHECKPOINT_DIR, f"{run_id}.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
     except Exception as e:
-        print(f"❌ Failed to load USERS_JSON: {e}")
+        log.warning(f"⚠️ Ignoring unreadable checkpoint: {e}")
+    if CHECKPOINT_BUCKET:
+        try:
+            response = aws_client('s3').get_object(Bucket=CHECKPOINT_BUCKET, Key=f"checkpoints/{run_id}.json")
+            return json.loads(response['Body'].read())
+        except Exception as e:
+            log.debug(f"ℹ️ No checkpoint in S3: {e}")
+    return None
+
+
+def drop_checkpoint(run_id):
+    """Remove a finished run's checkpoint"""
+    try:
+        os.remove(os.path.join(CHECKPOINT_DIR, f"{run_id}.json"))
+    except OSError:
+        pass
+    if CHECKPOINT_BUCKET:
+        try:
+            aws_client('s3').delete_object(Bucket=CHECKPOINT_BUCKET, Key=f"checkpoints/{run_id}.json")
+        except Exception as e:
+            log.warning(f"⚠️ Failed to delete checkpoint from S3: {e}")
+
+
+def continue_run(run_id, mode, results, pending, continuation):
+    """Checkpoint a run cut short by the deadline and hand the rest to a new invocation"""
+    checkpoint = {
+        'run_id': run_id,
+        'mode': mode,
+        'continuation': continuation,
+        'completed': results,
+        'pending': pending,
+        'user_costs': user_costs.export(),
+    }
+    save_checkpoint(run_id, checkpoint)
+    if not CHECKPOINT_BUCKET and CONTINUATION_BACKEND != 'local':
+        log.warning("⚠️ CHECKPOINT_BUCKET is unset; the continuation may not see earlier results")
+    log.info(f"➡️ Continuing run {run_id} via {CONTINUATION_BACKEND} ({len(pending)} users left)")
+    # The pending users travel in the payload too, so the next run can
+    # resume even if it lands in a container without this checkpoint
+    return INVOKE_BACKENDS[CONTINUATION_BACKEND]({
+        'mode': 'continue',
+        'run_id': run_id,
+        'users': pending,
+        'resume_mode': mode,
+    })
+
+
+def select_users(users, keys):
+    """Pick the configured users named (by user key) in a worker payload, in payload order"""
+    by_key = {user_key(u.get('username'), tenant_for(u).host): u for u in users}
+    missing = [key for key in keys if key not in by_key]
+    if missing:
+        log.warning(f"⚠️ Worker payload names unknown users: {missing}")
+    return [by_key[key] for key in keys if key in by_key]
+
+
+def lambda_handler(event, context):
+    """Lambda handler function.
+    
+    Event "mode" selects how users are processed: "dispatch" shards them
+    across worker invocations, "worker" processes only event["users"],
+    "backfill" archives every missing historical paystub to S3 (for
+    event["users"] if given), and anything else processes every
+    configured user here.
+    
+    Users that would not finish before the Lambda timeout are not started.
+    A worker reports them as "deferred"; other modes checkpoint the run
+    and resume it in a {"mode": "continue", "run_id": ...} invocation.
+    """
+    global cold_start
+    invocation_started = time.perf_counter()
+    event = event or {}
+    # Every record of the invocation carries these fields
+    log.run_context = {'run_id': event.get('run_id') or uuid.uuid4().hex, 'mode': event.get('mode') or 'all'}
+    log.info("🚀 Starting paystub download process...", region=os.environ.get('AWS_REGION'), event=event)
+    
+    was_cold = cold_start
+    if cold_start:
+        cold_start = False
+        INIT_REPORT['first_invoke_after_ms'] = round((invocation_started - MODULE_IMPORT_STARTED) * 1000, 1)
+    
+    # Chrome versions are probed once per container
+    probes = probe_environment()
+    log.info("🌐 Browser versions", chrome=probes['chrome'], chromedriver=probes['chromedriver'])
+    
+    # USERS_JSON is parsed and validated once at init
+    if USERS_ERROR:
+        log.error(f"❌ Failed to load USERS_JSON: {USERS_ERROR}")
         return {
             'statusCode': 500,
             'body': json.dumps('Invalid USERS_JSON')
         }
 
-    if not users:
-        print("❌ No users configured")
+    if not USERS:
+        log.error("❌ No users configured")
         return {
             'statusCode': 400,
             'body': json.dumps('No users configured')
         }
+    
+    # Work on copies so secrets resolved from SSM never leak into the cached config
+    users = [dict(user_config) for user_config in USERS]
+    log.info(f"📋 Loaded {len(users)} users from environment")
+    
+    mode = event.get('mode')
+    run_id = log.run_context['run_id']
+    continuation = 0
+    earlier_results = []
+    if mode == 'continue':
+        checkpoint = load_checkpoint(run_id) or {}
+        earlier_results = checkpoint.get('completed', [])
+        continuation = checkpoint.get('continuation', 0) + 1
+        user_costs.merge(checkpoint.get('user_costs'))
+        mode = checkpoint.get('mode') or event.get('resume_mode')
+        users = select_users(users, checkpoint.get('pending') or event.get('users') or [])
+        log.info(f"🔁 Resuming run {run_id} (continuation {continuation}) with {len(users)} users")
+    elif mode == 'worker':
+        users = select_users(users, event.get('users') or [])
+        log.info(f"👷 Worker processing {len(users)} users")
+    elif mode == 'backfill' and event.get('users'):
+        users = select_users(users, event['users'])
+    
+    # Without a Lambda context (local runs) there is no timeout to respect,
+    # but a worker still stops when its dispatcher runs out of time
+    if not hasattr(context, 'get_remaining_time_in_millis'):
+        context = None
+    limit_ms = event.get('deadline_ms') if mode == 'worker' else None
+    deadline = Deadline(context, limit_ms=limit_ms) if context is not None or limit_ms is not None else None
 
-
-
-
-    # Process each user
-    results = []
-    for i, user_config in enumerate(users):
-        print(f"\n{'='*50}")
-        print(f"Processing user {i+1} of {len(users)}")
-        print(f"{'='*50}")
-        
-        try:
-            # If passwords are stored in SSM, retrieve them
-            if 'password_param' in user_config:
-                user_config['password'] = get_parameter(user_config['password_param'])
-            if 'email_pass_param' in user_config:
-                user_config['email_pass'] = get_parameter(user_config['email_pass_param'])
-            
-            success = process_user(user_config)
-            results.append({
-                'username': user_config.get('username'),
-                'success': success
-            })
-        except Exception as e:
-            print(f"❌ Error processing user: {e}")
-            print(f"Traceback: {traceback.format_exc()}")
-            results.append({
-                'username': user_config.get('username', 'unknown'),
-                'success': False,
-                'error': str(e)
-            })
+    resource_monitor.reset_peak()
+    processing_started = time.perf_counter()
+    if mode == 'dispatch':
+        results = dispatch_users(users, int(event.get('shard_size') or SHARD_SIZE), deadline)
+    elif mode == 'backfill':
+        log.info(f"🗄️ Backfilling archives for {len(users)} users")
+        prefetch_user_secrets(users)
+        results = process_users(users, backfill_user, deadline)
+    else:
+        # Process users, several at a time when MAX_CONCURRENCY allows it
+        prefetch_user_secrets(users)
+        results = process_users(users, deadline=deadline)
+    
+    continued = None
+    pending = [user_key(r['username'], r.get('host', DEFAULT_TENANT.host))
+               for r in results if r.get('status') == 'deferred']
+    if pending and mode != 'worker':
+        finished = earlier_results + [r for r in results if r.get('status') != 'deferred']
+        if continuation < MAX_CONTINUATIONS:
+            try:
+                continue_run(run_id, mode, finished, pending, continuation)
+                continued = run_id
+            except Exception as e:
+                log.error(f"❌ Failed to start continuation: {e}")
+        else:
+            log.error(f"❌ Run {run_id} reached MAX_CONTINUATIONS with {len(pending)} users pending")
+    elif continuation:
+        drop_checkpoint(run_id)
+    if continued is None:
+        results = earlier_results + results
+    close_smtp_connections()
+    strategy_registry.save()
+    if was_cold:
+        # Printed after processing so first-use imports of selenium, boto3 and yagmail are included
+        log.info("🧊 Cold start report", init=INIT_REPORT)
+    timings = {
+        'total': (time.perf_counter() - invocation_started) * 1000,
+        'process_users': (time.perf_counter() - processing_started) * 1000,
+    }
+    peak = {name: round(mb, 1) for name, mb in resource_monitor.peak.items()}
+    emit_metrics('invocation', timings, {
+        'mode': mode or 'all',
+        'users': len(results),
+        'succeeded': sum(1 for r in results if r['success']),
+    }, peak)
     
-    print("\n✅ Process complete")
-    print(f"Results: {json.dumps(results, indent=2)}")
+    statuses = {}
+    for r in results:
+        statuses[r.get('status')] = statuses.get(r.get('status'), 0) + 1
+    log.info("✅ Process complete", users=len(results), statuses=statuses)
+    log.debug("📄 Results", results=results)
     
+    body = {'message': 'Paystub process complete'}
+    if continued:
+        body = {'message': 'Paystub process continuing', 'run_id': run_id, 'pending': pending}
     return {
         'statusCode': 200,
-        'body': json.dumps({
-            'message': 'Paystub process complete',
-            'results': results
-        })
-    }
\ No newline at end of file
+        'body': json.dumps(dict(body, **{
+            'results': results,
+            'timings': {name: round(ms, 1) for name, ms in timings.items()},
+            'resources': peak,
+        }))
+    }
+
+
+def load_users():
+    """Parse and validate USERS_JSON, returning (users, error)"""
+    try:
+        users = json.loads(os.environ.get("USERS_JSON", "[]"))
+    except Exception as e:
+        return [], str(e)
+    if not isinstance(users, list) or not all(isinstance(u, dict) for u in users):
+        return [], 'USERS_JSON must be a JSON list of objects'
+    for user_config in users:
+        base_url = user_config.get('base_url')
+        if base_url and urlparse(base_url).scheme not in ('http', 'https'):
+            return [], f"base_url must be an http(s) URL: {base_url}"
+        tenant = user_config.get('tenant')
+        if tenant and not re.fullmatch(r'[A-Za-z0-9-]+', str(tenant)):
+            return [], f"tenant must be a Viewpoint subdomain such as gibson-hff: {tenant}"
+    return users, None
+
+
+init_started = time.perf_counter()
+USERS, USERS_ERROR = load_users()
+INIT_REPORT['users_ms'] = round((time.perf_counter() - init_started) * 1000, 1)
+INIT_REPORT['import_ms'] = round((time.perf_counter() - MODULE_IMPORT_STARTED) * 1000, 1)